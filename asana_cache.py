@@ -0,0 +1,147 @@
+"""Handles caching Asana tasks and subtasks on disk."""
+
+import json
+import os
+import sqlite3
+import threading
+
+
+class TaskCache:
+    """An SQLite cache of incomplete Asana tasks with due dates and the subtasks of each task."""
+
+    def __init__(self, path: str) -> None:
+        """Opens the cache, creating it if it does not exist.
+
+        Parameters:
+            path (str): the path to the cache database.
+        """
+
+        directory = os.path.dirname(path)
+
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS tasks (gid TEXT PRIMARY KEY, modified_at TEXT, data TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS subtasks (parent_gid TEXT PRIMARY KEY, modified_at TEXT, data TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def get_meta(self, key: str) -> str:
+        """Get a value stored about the cache.
+
+        Parameters:
+            key (str): the name of the value.
+
+        Returns:
+            value (str): the value, or None if it has not been set.
+        """
+
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        """Store a value about the cache.
+
+        Parameters:
+            key (str): the name of the value.
+            value (str): the value.
+        """
+
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def get_tasks(self) -> list:
+        """Get every cached task.
+
+        Returns:
+            tasks (list): a list of Asana tasks, sorted by due date and then GID.
+        """
+
+        with self.lock:
+            rows = self.connection.execute('SELECT data FROM tasks').fetchall()
+
+        tasks = [json.loads(row[0]) for row in rows]
+        tasks.sort(key=lambda x: (x['due_on'], x['gid']))
+        return tasks
+
+    def replace_tasks(self, tasks: list) -> None:
+        """Replace every cached task, and remove every cached subtask so they are fetched again.
+
+        Subtasks completed in Asana do not modify their task, so refetching them here is the only way to catch them.
+
+        Parameters:
+            tasks (list): a list of Asana tasks.
+        """
+
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM tasks')
+            self.connection.executemany(
+                'INSERT INTO tasks (gid, modified_at, data) VALUES (?, ?, ?)',
+                [(task['gid'], task['modified_at'], json.dumps(task)) for task in tasks]
+            )
+            self.connection.execute('DELETE FROM subtasks')
+
+    def update_tasks(self, tasks: list, removed_gids: list) -> None:
+        """Add or update cached tasks and remove others.
+
+        Parameters:
+            tasks (list): a list of Asana tasks to add or update.
+            removed_gids (list): the GIDs of tasks to remove, along with their subtasks.
+        """
+
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO tasks (gid, modified_at, data) VALUES (?, ?, ?)',
+                [(task['gid'], task['modified_at'], json.dumps(task)) for task in tasks]
+            )
+            self.connection.executemany('DELETE FROM tasks WHERE gid = ?', [(gid,) for gid in removed_gids])
+            self.connection.executemany('DELETE FROM subtasks WHERE parent_gid = ?', [(gid,) for gid in removed_gids])
+
+    def get_subtasks(self, parent_gid: str, modified_at: str = None) -> list:
+        """Get the cached subtasks of a task if they were cached since the task was last modified.
+
+        Parameters:
+            parent_gid (str): the GID of the task.
+            modified_at (str): when the task was last modified. If not given, the subtasks are returned however old they are.
+
+        Returns:
+            subtasks (list): a list of Asana subtasks, or None if they are not cached or out of date.
+        """
+
+        with self.lock:
+            row = self.connection.execute('SELECT modified_at, data FROM subtasks WHERE parent_gid = ?', (parent_gid,)).fetchone()
+
+        if row is None or (modified_at is not None and row[0] != modified_at):
+            return None
+
+        return json.loads(row[1])
+
+    def set_subtasks(self, parent_gid: str, modified_at: str, subtasks: list) -> None:
+        """Cache the subtasks of a task.
+
+        Parameters:
+            parent_gid (str): the GID of the task.
+            modified_at (str): when the task was last modified.
+            subtasks (list): a list of Asana subtasks.
+        """
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO subtasks (parent_gid, modified_at, data) VALUES (?, ?, ?)',
+                (parent_gid, modified_at, json.dumps(subtasks))
+            )
+
+    def invalidate_subtasks(self, parent_gids: list) -> None:
+        """Remove the cached subtasks of tasks so they are fetched again.
+
+        Parameters:
+            parent_gids (list): the GIDs of the tasks.
+        """
+
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM subtasks WHERE parent_gid = ?', [(gid,) for gid in parent_gids])
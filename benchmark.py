@@ -0,0 +1,599 @@
+"""Benchmarks for Rhythm against local fake services.
+
+Run a benchmark with:
+
+python benchmark.py [BENCHMARK]
+
+where BENCHMARK is one of the names in BENCHMARKS. If no benchmark is given, all of them are run.
+"""
+
+import contextlib
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import fakes
+import packing
+import request_scheduler
+import ruleset_repository
+import schedule
+
+ROUND_TRIP_SECONDS = 0.05  # Simulated latency of one HTTPS round trip
+FAKE_TASK_COUNT = 2000  # Asana tasks assigned to the fake user
+FAKE_SUBTASK_COUNT = 5  # Subtasks of each fake task that has subtasks
+FAKE_SUBTASK_RATIO = 0.1  # Share of fake tasks that have subtasks
+FAKE_ERROR_RATE = 0  # Share of fake requests that fail with a server error, which needs the Asana and Google clients installed
+
+
+def make_events(count: int) -> list:
+    """Create a list of simple event bodies."""
+    return [{'summary': f'Block {i}', 'start': {'dateTime': ''}, 'end': {'dateTime': ''}} for i in range(count)]
+
+
+def make_fake_asana(backend: fakes.FakeBackend, cache_path: str = None, workspace_gids: list = None, subtask_ratio: float = FAKE_SUBTASK_RATIO):
+    """Create a RhythmAsana that reads the fake user's tasks from a fake Asana client."""
+    from rhythm_asana import RhythmAsana
+
+    tasks, subtasks = fakes.make_asana_tasks(FAKE_TASK_COUNT, FAKE_SUBTASK_COUNT, subtask_ratio, workspace_gids=workspace_gids)
+    client = fakes.FakeAsanaClient(tasks, subtasks, backend)
+    return RhythmAsana('', '', workspace_gids if workspace_gids is not None else '', cache_path=cache_path, duration_field='Estimate', client=client)
+
+
+def benchmark_calendar():
+    """Compare inserting events one at a time with inserting them in batches, both within the Calendar rate limit."""
+    from gcalendar import Calendar
+
+    service = fakes.FakeCalendarService(fakes.FakeBackend(ROUND_TRIP_SECONDS))
+    calendar = Calendar(8, service=service)
+    rate, burst, _ = request_scheduler.SERVICES['calendar']
+
+    print(f'Calendar inserts ({ROUND_TRIP_SECONDS * 1000:.0f} ms per round trip)')
+    print('blocks  sequential (s)  batched (s)')
+
+    for count in [5, 10, 20, 30, 60]:
+        events = make_events(count)
+
+        # Each way starts with a full burst, so neither waits for requests sent by the other
+        calendar.scheduler.bucket = request_scheduler.TokenBucket(rate, burst)
+        start = time.perf_counter()
+        for event in events:
+            calendar.scheduler.execute(service.events().insert(calendarId='primary', body=event).execute)
+        sequential = time.perf_counter() - start
+
+        calendar.scheduler.bucket = request_scheduler.TokenBucket(rate, burst)
+        start = time.perf_counter()
+        calendar.insert_events(events)
+        batched = time.perf_counter() - start
+
+        print(f'{count:>6}  {sequential:>14.3f}  {batched:>11.3f}')
+
+
+def legacy_generate_schedule(path: str) -> tuple[str, int]:
+    """The minute array version of schedule.generate_schedule, kept to check the new version against."""
+    with open(path) as file:
+        ruleset = file.read().split('\n')
+
+    minutes = ['Todo List'] * (24 * 60)
+
+    for rule in ruleset:
+        comment_index = rule.find('#')
+
+        if comment_index != -1:
+            rule = rule[:comment_index].strip()
+
+        rule_args = rule.split(', ')
+        name = rule_args[0] + ''
+
+        if len(rule_args) != 3:
+            continue
+
+        start_time = schedule.time_to_minutes(rule_args[1])
+        end_time = schedule.time_to_minutes(rule_args[2])
+
+        if start_time == -1 or end_time == -1:
+            continue
+
+        for t in range(start_time, end_time):
+            minutes[t] = name + ''
+
+    result = ''
+    m = 0
+
+    while True:
+        if m >= len(minutes):
+            break
+
+        if minutes[m] == '':
+            m += 1
+            continue
+
+        task = minutes[m] + ''
+        start_m = m + 0
+        filled = False
+
+        for t in range(m + 1, len(minutes)):
+            if minutes[t] != task:
+                end_m = t + 0
+                filled = True
+                break
+
+        if not filled:
+            end_m = len(minutes) + 0
+
+        start_hour = int(start_m / 60)
+        end_hour = int(end_m / 60)
+        start_minute = str(start_m % 60).zfill(2)
+        end_minute = str(end_m % 60).zfill(2)
+
+        result += f'{task}, {start_hour}:{start_minute}, {end_hour}:{end_minute}\n'
+        m = end_m + 0
+
+    return result.strip(), minutes.count('Todo List')
+
+
+def make_ruleset(rng: random.Random, rule_count: int) -> str:
+    """Create a random ruleset with overlapping rules, comments, and invalid lines."""
+    names = ['Sleep', 'Breakfast', 'Lunch', 'Dinner', 'Gym', 'Commute', 'Todo List', 'Reading', '']
+    lines = ['Random ruleset']
+
+    for _ in range(rule_count):
+        start = rng.randrange(0, 24 * 60)
+        end = rng.randrange(start, 24 * 60 + 1)
+        line = f'{rng.choice(names)}, {start // 60}:{str(start % 60).zfill(2)}, {end // 60}:{str(end % 60).zfill(2)}'
+
+        kind = rng.random()
+        if kind < 0.1:
+            line += '  # comment'
+        elif kind < 0.15:
+            line = '# ' + line
+        elif kind < 0.2:
+            line = line.replace(', ', ',', 1)
+
+        lines.append(line)
+
+    return '\n'.join(lines)
+
+
+def benchmark_schedule():
+    """Check that generate_schedule matches the minute array version and compare their speed."""
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+
+        for i in range(200):
+            path = os.path.join(directory, f'{i}.txt')
+
+            with open(path, 'w') as file:
+                file.write(make_ruleset(rng, rng.randrange(0, 40)))
+
+            paths.append(path)
+
+        for path in paths:
+            if schedule.generate_schedule(path) != legacy_generate_schedule(path):
+                raise AssertionError(f'Schedules do not match for ruleset:\n{open(path).read()}')
+
+        print(f'generate_schedule matches on {len(paths)} rulesets')
+
+        def uncached_generate_schedule(path):
+            with open(path) as file:
+                blocks = schedule.build_blocks(ruleset_repository.parse_ruleset(file.read()).rules)
+
+            return schedule.format_schedule(blocks), schedule.todo_minutes(blocks)
+
+        functions = [
+            ('minute array', legacy_generate_schedule),
+            ('intervals', uncached_generate_schedule),
+            ('intervals (cached ruleset)', schedule.generate_schedule)
+        ]
+
+        for name, function in functions:
+            start = time.perf_counter()
+
+            for path in paths:
+                function(path)
+
+            elapsed = time.perf_counter() - start
+            print(f'{name:<26}  {elapsed / len(paths) * 1000:.3f} ms per ruleset')
+
+
+def benchmark_check():
+    """Time checking a directory of rulesets for issues, with nothing cached and then from the cache file."""
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+
+        for i in range(500):
+            path = os.path.join(directory, f'{i}.txt')
+
+            with open(path, 'w') as file:
+                file.write(make_ruleset(rng, rng.randrange(0, 40)))
+
+            paths.append(path)
+
+        cache_path = os.path.join(directory, 'rulesets.json')
+
+        for name in ['nothing cached', 'cache file']:
+            start = time.perf_counter()
+            repository = ruleset_repository.RulesetRepository(cache_path)
+            issues = 0
+
+            for path in paths:
+                issues += len(repository.load(path).issues)
+                repository.load_compiled(path, 'blocks-60', lambda ruleset: [list(block) for block in schedule.build_blocks(ruleset.rules)])
+
+            repository.save()
+            elapsed = time.perf_counter() - start
+            print(f'{name:<14}  {len(paths)} rulesets  {issues} issues  {elapsed * 1000:.1f} ms')
+
+
+def benchmark_includes():
+    """Time compiling a week of rulesets that copy a shared base against a week that extends it."""
+    rng = random.Random(0)
+    days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    base = make_ruleset(rng, 200).split('\n', 1)[1]
+    meals = make_ruleset(rng, 20).split('\n', 1)[1]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ['copied', 'extends']:
+            os.makedirs(os.path.join(directory, name, 'rulesets'))
+
+            with open(os.path.join(directory, name, 'rulesets', 'workday.txt'), 'w') as file:
+                file.write(f'Workday\n@include meals\n{base}')
+
+            with open(os.path.join(directory, name, 'rulesets', 'meals.txt'), 'w') as file:
+                file.write(f'Meals\n{meals}')
+
+            paths = []
+
+            for day in days:
+                path = os.path.join(directory, name, f'{day}.txt')
+                rules = make_ruleset(rng, 5).split('\n', 1)[1]
+
+                with open(path, 'w') as file:
+                    file.write(f'{day}\n{meals}\n{base}\n{rules}' if name == 'copied' else f'{day}\n@extends workday\n{rules}')
+
+                paths.append(path)
+
+            start = time.perf_counter()
+            repository = ruleset_repository.RulesetRepository(include_directory=os.path.join(directory, name, 'rulesets'))
+
+            for path in paths:
+                repository.load_compiled(path, 'blocks-60', lambda ruleset: [list(block) for block in schedule.build_blocks(ruleset.rules)])
+
+            elapsed = time.perf_counter() - start
+            parsed_rules = sum(len(ruleset.rules) for _, ruleset in repository.rulesets.values())
+            print(f'{name:<8}  {len(repository.rulesets)} files parsed  {parsed_rules} rules parsed  {elapsed * 1000:.1f} ms')
+
+
+def benchmark_packing():
+    """Time packing backlogs of different sizes into a week of Todo List blocks."""
+    rng = random.Random(0)
+    capacities = [rng.choice([30, 60, 90, 120, 180, 240]) for _ in range(35)]
+
+    print(f'Packing into {len(capacities)} blocks ({sum(capacities)} minutes)')
+    print(' tasks  placed  time (ms)')
+
+    for count in [100, 1000, 5000, 20000]:
+        durations = [rng.choice([5, 15, 30, 45, 60, 90, 120, 180, 300]) for _ in range(count)]
+
+        start = time.perf_counter()
+        assignments = packing.pack_tasks(durations, capacities)
+        elapsed = time.perf_counter() - start
+
+        placed = sum(1 for a in assignments if a != -1)
+        print(f'{count:>6}  {placed:>6}  {elapsed * 1000:>9.2f}')
+
+
+def benchmark_get_tasks():
+    """Time getting tasks from a fake Asana account without the cache, with an empty cache, and with a full cache."""
+    backend = fakes.FakeBackend(ROUND_TRIP_SECONDS, FAKE_ERROR_RATE)
+
+    print(f'Getting {FAKE_TASK_COUNT} Asana tasks, {FAKE_SUBTASK_RATIO:.0%} with {FAKE_SUBTASK_COUNT} subtasks ({ROUND_TRIP_SECONDS * 1000:.0f} ms per round trip)')
+    print('case           time (s)  round trips  tasks')
+
+    with tempfile.TemporaryDirectory() as directory:
+        uncached = make_fake_asana(backend)
+        cached = make_fake_asana(backend, os.path.join(directory, 'asana.db'))
+
+        cases = [
+            ('no cache', lambda: uncached.get_tasks('monday', use_cache=False)),
+            ('empty cache', lambda: cached.get_tasks('monday')),
+            ('full cache', lambda: cached.get_tasks('monday'))
+        ]
+
+        for name, function in cases:
+            round_trips = backend.round_trips
+            start = time.perf_counter()
+            rhythm_tasks = function()
+            elapsed = time.perf_counter() - start
+
+            print(f'{name:<13}  {elapsed:>8.3f}  {backend.round_trips - round_trips:>11}  {len(rhythm_tasks):>5}')
+
+        # Let go of the cache so its directory can be removed
+        for cache in cached.caches.values():
+            cache.connection.close()
+
+
+def benchmark_plan():
+    """Time planning a week of resets from data that was already read, apart from the calls that read it."""
+    from datetime import date, timedelta
+
+    import planner
+
+    backend = fakes.FakeBackend(0)
+    rhythm_tasks = make_fake_asana(backend).get_tasks('monday', use_cache=False)
+    listed_tasks = [{'id': str(i), 'title': task['title'], 'notes': task['notes']} for i, task in enumerate(rhythm_tasks[:100])]
+    completed_gids = [planner.task_gid(task) for task in listed_tasks[:20]]
+
+    days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    dates = [date(2024, 1, 1) + timedelta(days=i) for i in range(len(days))]
+    rules = ruleset_repository.parse_ruleset('Day\nSleep, 0:00, 7:00\nLunch, 12:00, 13:00\nDinner, 18:00, 19:00\nSleep, 23:00, 24:00').rules
+    schedules = {day: schedule.build_blocks(rules) for day in days}
+
+    print(f'Planning a week with {len(rhythm_tasks)} Asana tasks')
+
+    for use_slots in [False, True]:
+        start = time.perf_counter()
+
+        for _ in range(10):
+            plan = planner.plan_reset(days, dates, schedules, rhythm_tasks, completed_gids, listed_tasks, '+00', 8, use_slots)
+
+        elapsed = (time.perf_counter() - start) / 10
+        estimates = planner.estimate_calls(plan)
+        events = sum(len(events) for _, events in plan.operations['events'])
+        print(f'slots {str(use_slots):<5}  {len(plan.operations["insert"])} inserts  {events} events  '
+              f'{sum(calls for calls, _ in estimates.values())} calls  {elapsed * 1000:.1f} ms')
+
+
+def check_reset(reset_plan, tasks_service, calendar_service, journal_path: str) -> None:
+    """Check that a finished reset left exactly the planned tasks and events and removed its journal."""
+    import planner
+
+    listed_gids = [planner.task_gid(item) for item in tasks_service.items]
+
+    if listed_gids != [key for key, _ in reset_plan.operations['insert']]:
+        raise AssertionError('Tasklist does not hold exactly the planned tasks in order')
+
+    def event_times(events):
+        return sorted((event['summary'], event['start']['dateTime'], event['end']['dateTime']) for event in events)
+
+    planned_events = [event for _, events in reset_plan.operations['events'] for event in events]
+
+    if event_times(calendar_service.items.values()) != event_times(planned_events):
+        raise AssertionError('Calendar does not hold exactly the planned events')
+
+    if os.path.exists(journal_path):
+        raise AssertionError('Journal was left after the reset finished')
+
+
+def benchmark_reset():
+    """Time resetting a day end to end against fake services, including finishing an interrupted reset and dropping a
+    cancelled or out of date one, then show the calls made to each one.
+
+    After each reset that finishes, the tasklist and calendar are checked against the plan it made.
+    """
+    from datetime import date, timedelta
+
+    import gcalendar
+    import jobs
+    import journal
+    import main
+    import metrics
+    import tasks
+
+    backend = fakes.FakeBackend(ROUND_TRIP_SECONDS, FAKE_ERROR_RATE)
+    tasks_service = fakes.FakeTasksService(backend)
+    calendar_service = fakes.FakeCalendarService(backend)
+    directory = os.getcwd()
+
+    print(f'Resetting Monday with {FAKE_TASK_COUNT} Asana tasks ({ROUND_TRIP_SECONDS * 1000:.0f} ms per round trip)')
+    print('case           time (s)  round trips  received (KB)')
+
+    with tempfile.TemporaryDirectory() as fake_directory:
+        os.chdir(fake_directory)
+        plan_reset = main.plan_reset
+        plans = []
+
+        def record_plan(*args, **kwargs):
+            plans.append(plan_reset(*args, **kwargs))
+            return plans[-1]
+
+        try:
+            os.makedirs('current_rulesets')
+
+            with open('current_rulesets/monday.txt', 'w') as file:
+                file.write('Monday\nSleep, 0:00, 7:00\nBreakfast, 7:00, 7:30\nLunch, 12:00, 13:00\nDinner, 18:00, 19:00\nSleep, 23:00, 24:00')
+
+            main.asana = make_fake_asana(backend, 'cache/asana.db')
+            main.calendar = gcalendar.Calendar(8, service=calendar_service)
+            main.google_tasks = tasks.Tasks('', service=tasks_service)
+            main.plan_reset = record_plan
+            metrics.enable()
+
+            add_tasks = main.google_tasks.add_tasks
+            clear_tasks = main.google_tasks.clear_tasks
+            job = None
+
+            def crash(_):
+                raise RuntimeError('crashed before adding tasks')
+
+            def cancel(listed_tasks):
+                job.cancel_event.set()
+                return clear_tasks(listed_tasks)
+
+            cases = ['first reset', 'second reset', 'interrupted', 'resumed', 'cancelled', 'after cancel', 'last week', 'replanned']
+
+            for name in cases:
+                if name in ('second reset', 'interrupted', 'cancelled', 'last week'):
+                    # Complete a few tasks in Google Tasks, like a user would during the day
+                    for item in tasks_service.items[:5]:
+                        tasks_service.complete(item['id'])
+
+                # Stop a reset after the tasklist is cleared, then run it again to finish it from the journal. A reset
+                # that was cancelled, or stopped on another day, is planned again instead.
+                main.google_tasks.add_tasks = crash if name in ('interrupted', 'last week') else add_tasks
+                main.google_tasks.clear_tasks = cancel if name == 'cancelled' else clear_tasks
+                job = jobs.Job(0, 'reset monday', None) if name == 'cancelled' else None
+                plan_count = len(plans)
+
+                round_trips = backend.round_trips
+                received = sum(stat.bytes for stat in metrics.stats.values())
+                start = time.perf_counter()
+
+                with contextlib.redirect_stdout(io.StringIO()), contextlib.suppress(RuntimeError, jobs.Cancelled):
+                    main.reset(['monday'], [], job)
+
+                elapsed = time.perf_counter() - start
+                received = sum(stat.bytes for stat in metrics.stats.values()) - received
+                print(f'{name:<13}  {elapsed:>8.3f}  {backend.round_trips - round_trips:>11}  {received / 1024:>13.1f}')
+
+                if name == 'last week':
+                    # Move the interrupted reset back a week, as if Rhythm was closed during last Monday's reset
+                    previous = journal.Journal.load(main.JOURNAL_PATH)
+                    previous.dates = [(date.fromisoformat(d) - timedelta(days=7)).isoformat() for d in previous.dates]
+                    previous.planned = (date.fromisoformat(previous.planned) - timedelta(days=7)).isoformat()
+                    previous.save()
+                elif name == 'cancelled':
+                    if not journal.Journal.load(main.JOURNAL_PATH).abandoned:
+                        raise AssertionError('Cancelled reset did not mark its journal as abandoned')
+                elif name != 'interrupted':
+                    # Failed requests are reported without being made, so the result only matches the plan without them
+                    if FAKE_ERROR_RATE == 0:
+                        check_reset(plans[-1], tasks_service, calendar_service, main.JOURNAL_PATH)
+
+                    if name == 'resumed' and len(plans) != plan_count:
+                        raise AssertionError('Resumed reset was planned again')
+
+                    if name != 'resumed' and len(plans) != plan_count + 1:
+                        raise AssertionError(f'Reset in the {name} case was not planned')
+
+            print()
+            print(metrics.format_stats())
+        finally:
+            main.plan_reset = plan_reset
+            metrics.disable()
+            metrics.reset()
+            for cache in main.asana.caches.values():
+                cache.connection.close()
+            os.chdir(directory)
+
+
+def benchmark_workspaces():
+    """Compare getting tasks from several workspaces one after another with getting them concurrently.
+
+    The tasks have no subtasks, so only listing the tasks is timed.
+    """
+    from rhythm_asana import RhythmAsana
+
+    backend = fakes.FakeBackend(ROUND_TRIP_SECONDS, FAKE_ERROR_RATE)
+
+    print(f'Getting {FAKE_TASK_COUNT} Asana tasks spread across workspaces ({ROUND_TRIP_SECONDS * 1000:.0f} ms per round trip)')
+    print('workspaces  sequential (s)  concurrent (s)  tasks')
+
+    for count in [1, 2, 5]:
+        workspace_gids = [str(i) for i in range(count)]
+        asana = make_fake_asana(backend, workspace_gids=workspace_gids, subtask_ratio=0)
+
+        start = time.perf_counter()
+        sequential_tasks = []
+
+        for workspace_gid in workspace_gids:
+            single = RhythmAsana('', '', workspace_gid, duration_field='Estimate', client=asana.client)
+            sequential_tasks += single.get_tasks('monday', use_cache=False)
+
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rhythm_tasks = asana.get_tasks('monday', use_cache=False)
+        concurrent = time.perf_counter() - start
+
+        if sorted(task['notes'] for task in rhythm_tasks) != sorted(task['notes'] for task in sequential_tasks):
+            raise AssertionError('Concurrent tasks do not match sequential tasks')
+
+        print(f'{count:>10}  {sequential:>14.3f}  {concurrent:>14.3f}  {len(rhythm_tasks):>5}')
+
+
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+
+import gcalendar
+import tasks
+
+calendar = gcalendar.Calendar(8)
+google_tasks = tasks.Tasks('')
+print(f'create clients      {time.perf_counter() - start:.3f}s')
+
+start = time.perf_counter()
+calendar.service
+google_tasks.service
+print(f'build services      {time.perf_counter() - start:.3f}s')
+"""
+
+
+def benchmark_startup():
+    """Time creating the Google clients and building their services in a new process.
+
+    Building the services needs saved Google credentials in the credentials folder.
+    """
+    subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], check=True)
+
+
+def benchmark_imports():
+    """Measure how long importing main takes with python -X importtime, and show the slowest imports."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], capture_output=True, text=True, check=True)
+    children = []
+    total = 0
+
+    for line in result.stderr.split('\n'):
+        # Lines look like: import time: self [us] | cumulative | imported package, indented two spaces per level
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+
+        if depth == 0:
+            # Imports are printed after everything they import, so the children seen so far belong to this one
+            if name.strip() == 'main':
+                total = int(cumulative)
+                break
+
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative), name.strip()))
+
+    print(f'import main         {total / 1e6:.3f}s')
+    print('slowest imports made by main:')
+
+    for cumulative, name in sorted(children, reverse=True)[:10]:
+        print(f'  {name:<24}{cumulative / 1e6:.3f}s')
+
+
+BENCHMARKS = {
+    'calendar': benchmark_calendar,
+    'check': benchmark_check,
+    'get_tasks': benchmark_get_tasks,
+    'imports': benchmark_imports,
+    'includes': benchmark_includes,
+    'packing': benchmark_packing,
+    'plan': benchmark_plan,
+    'reset': benchmark_reset,
+    'schedule': benchmark_schedule,
+    'startup': benchmark_startup,
+    'workspaces': benchmark_workspaces,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(BENCHMARKS)
+
+    for name in names:
+        BENCHMARKS[name]()
+        print()
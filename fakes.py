@@ -0,0 +1,554 @@
+"""Fake Asana, Google Tasks, and Google Calendar services that keep their data in memory.
+
+The fakes stand in for the Asana client and the Google API services, so Rhythm's own code runs unchanged against
+them. Each fake simulates network latency and can fail a share of requests with the same errors the real clients raise.
+"""
+
+import copy
+import itertools
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+ASANA_PAGE_SIZE = 100
+TASKS_PAGE_SIZE = 20  # Google Tasks returns 20 tasks per page unless asked for more
+TASKS_MAX_PAGE_SIZE = 100
+EVENTS_PAGE_SIZE = 250
+BATCH_LIMIT = 1000  # Most requests Google allows in one batch
+
+
+def parse_time(value: str) -> datetime:
+    """Parse an ISO 8601 time from Asana or Google, which may end in Z."""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def format_asana_time(value: datetime) -> str:
+    """Format a time the way Asana does (ex: 2023-01-01T12:00:00.000Z)."""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.') + f'{value.microsecond // 1000:03d}Z'
+
+
+def parse_fields(fields: str) -> dict:
+    """Parse a Google fields parameter (ex: nextPageToken,items(id,start/dateTime)) into a tree of field names."""
+
+    tree = {}
+    depth = 0
+    start = 0
+
+    for i, character in enumerate(fields + ','):
+        if character == '(':
+            depth += 1
+        elif character == ')':
+            depth -= 1
+        elif character == ',' and depth == 0:
+            item = fields[start:i].strip()
+            start = i + 1
+
+            if item == '':
+                continue
+
+            path, _, subfields = item.partition('(')
+            node = tree
+            names = path.split('/')
+
+            for name in names[:-1]:
+                node = node.setdefault(name, {})
+
+            node[names[-1]] = parse_fields(subfields[:-1]) if subfields != '' else None
+
+    return tree
+
+
+def parse_opt_fields(opt_fields: list) -> dict:
+    """Parse Asana opt_fields (ex: this.memberships.project.name) into a tree of field names."""
+
+    tree = {'gid': None}  # Asana always sends the GID
+
+    for field in opt_fields:
+        node = tree
+        names = field.removeprefix('this.').split('.')
+
+        for name in names[:-1]:
+            node = node.setdefault(name, {'gid': None}) or {}
+
+        node[names[-1]] = None
+
+    return tree
+
+
+def project(resource, tree: dict):
+    """Keep only the fields of a resource that are in a tree of field names, like the real APIs do."""
+
+    if tree is None:
+        return resource
+
+    if isinstance(resource, list):
+        return [project(item, tree) for item in resource]
+
+    if not isinstance(resource, dict):
+        return resource
+
+    return {name: project(resource[name], subtree) for name, subtree in tree.items() if name in resource}
+
+
+class FakeBackend:
+    """Simulates the network between Rhythm and a service."""
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0, seed: int = 0) -> None:
+        """Creates a backend.
+
+        Parameters:
+            latency (float): the seconds each round trip takes.
+            error_rate (float): the share of requests that fail with a server error, from 0 to 1.
+            seed (int): the seed for choosing which requests fail.
+        """
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.round_trips = 0
+
+    def round_trip(self) -> None:
+        """Wait for one round trip."""
+
+        with self.lock:
+            self.round_trips += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def should_fail(self) -> bool:
+        """Decide if the current request fails."""
+
+        if self.error_rate == 0:
+            return False
+
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+
+def google_error(status: int):
+    """Create the error the Google API client raises for a response status."""
+
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    return HttpError(httplib2.Response({'status': status}), b'{"error": {"message": "Fake server error"}}')
+
+
+def asana_error():
+    """Create the error the Asana client raises for a server error."""
+
+    import asana
+
+    return asana.error.ServerError(None)
+
+
+class FakeRequest:
+    """A fake Google API request that runs a function on the fake service when executed."""
+
+    def __init__(self, backend: FakeBackend, method_id: str, function, fields: str = None) -> None:
+        self.backend = backend
+        self.methodId = method_id
+        self.function = function
+        self.fields = parse_fields(fields) if fields is not None else None
+
+    def run(self):
+        """Run the request without waiting for a round trip, as part of a batch."""
+
+        if self.backend.should_fail():
+            raise google_error(503)
+
+        return project(self.function(), self.fields)
+
+    def execute(self):
+        self.backend.round_trip()
+        return self.run()
+
+
+class FakeBatch:
+    """A fake Google API batch request that sends all of its requests in one round trip."""
+
+    def __init__(self, backend: FakeBackend, callback) -> None:
+        self.backend = backend
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: FakeRequest, request_id: str = None) -> None:
+        if len(self.requests) >= BATCH_LIMIT:
+            raise ValueError(f'Batches can have at most {BATCH_LIMIT} requests')
+
+        self.requests.append((request_id if request_id is not None else str(len(self.requests)), request))
+
+    def execute(self) -> None:
+        self.backend.round_trip()
+
+        for request_id, request in self.requests:
+            try:
+                response = request.run()
+            except Exception as e:
+                self.callback(request_id, None, e)
+            else:
+                self.callback(request_id, response, None)
+
+
+class FakeGoogleService:
+    """The parts shared by the fake Google services."""
+
+    def __init__(self, backend: FakeBackend = None) -> None:
+        self.backend = backend if backend is not None else FakeBackend()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def request(self, method_id: str, function, fields: str = None) -> FakeRequest:
+        return FakeRequest(self.backend, method_id, function, fields)
+
+    def new_batch_http_request(self, callback=None) -> FakeBatch:
+        return FakeBatch(self.backend, callback)
+
+
+class FakeTasksResource:
+    def __init__(self, service) -> None:
+        self.service = service
+
+    def insert(self, tasklist: str, body: dict, previous: str = None, fields: str = None) -> FakeRequest:
+        return self.service.request('tasks.tasks.insert', lambda: self.service.insert(body, previous), fields)
+
+    def list(self, tasklist: str, maxResults: int = TASKS_PAGE_SIZE, pageToken: str = None, showHidden: bool = False,
+             showCompleted: bool = True, completedMin: str = None, fields: str = None) -> FakeRequest:
+        return self.service.request('tasks.tasks.list', lambda: self.service.list(maxResults, pageToken, showHidden, showCompleted, completedMin), fields)
+
+    def move(self, tasklist: str, task: str, previous: str = None, fields: str = None) -> FakeRequest:
+        return self.service.request('tasks.tasks.move', lambda: self.service.move(task, previous), fields)
+
+    def delete(self, tasklist: str, task: str) -> FakeRequest:
+        return self.service.request('tasks.tasks.delete', lambda: self.service.delete(task))
+
+
+class FakeTasksService(FakeGoogleService):
+    """A fake Google Tasks service with a single tasklist."""
+
+    def __init__(self, backend: FakeBackend = None) -> None:
+        """Creates an empty tasklist.
+
+        Parameters:
+            backend (FakeBackend): the simulated network. If not given, each round trip takes 50 ms and none fail.
+        """
+
+        super().__init__(backend)
+        self.items = []  # From the top of the list to the bottom
+
+    def tasks(self) -> FakeTasksResource:
+        return FakeTasksResource(self)
+
+    def insert(self, body: dict, previous: str = None) -> dict:
+        with self.lock:
+            item = {'id': str(next(self.ids)), 'status': 'needsAction', **copy.deepcopy(body)}
+            index = self.__index_after(previous)
+            self.items.insert(index, item)
+            return self.__with_position(item, index)
+
+    def list(self, max_results: int, page_token: str, show_hidden: bool, show_completed: bool, completed_min: str) -> dict:
+        with self.lock:
+            items = [self.__with_position(item, i) for i, item in enumerate(self.items)]
+
+        items = [item for item in items if show_hidden or not item.get('hidden', False)]
+        items = [item for item in items if show_completed or item['status'] != 'completed']
+
+        if completed_min is not None:
+            items = [item for item in items if item['status'] != 'completed' or parse_time(item['completed']) >= parse_time(completed_min)]
+
+        start = int(page_token) if page_token is not None else 0
+        end = start + min(max_results, TASKS_MAX_PAGE_SIZE)
+        response = {'kind': 'tasks#tasks'}
+
+        # Google leaves out the items of an empty page
+        if len(items[start:end]) != 0:
+            response['items'] = items[start:end]
+
+        if end < len(items):
+            response['nextPageToken'] = str(end)
+
+        return response
+
+    def move(self, task_id: str, previous: str = None) -> dict:
+        with self.lock:
+            item = self.items.pop(self.__index(task_id))
+            index = self.__index_after(previous)
+            self.items.insert(index, item)
+            return self.__with_position(item, index)
+
+    def delete(self, task_id: str) -> str:
+        with self.lock:
+            self.items.pop(self.__index(task_id))
+            return ''
+
+    def complete(self, task_id: str) -> None:
+        """Mark a task as completed, the way completing it in a Google app does."""
+
+        with self.lock:
+            item = self.items[self.__index(task_id)]
+            item['status'] = 'completed'
+            item['completed'] = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+            item['hidden'] = True
+
+    def __index(self, task_id: str) -> int:
+        for i, item in enumerate(self.items):
+            if item['id'] == task_id:
+                return i
+
+        raise google_error(404)
+
+    def __index_after(self, previous: str) -> int:
+        return self.__index(previous) + 1 if previous is not None else 0
+
+    def __with_position(self, item: dict, index: int) -> dict:
+        item = copy.deepcopy(item)
+        item['position'] = str(index).zfill(20)
+        return item
+
+
+class FakeEventsResource:
+    def __init__(self, service) -> None:
+        self.service = service
+
+    def insert(self, calendarId: str, body: dict, fields: str = None) -> FakeRequest:
+        return self.service.request('calendar.events.insert', lambda: self.service.insert(body), fields)
+
+    def patch(self, calendarId: str, eventId: str, body: dict, fields: str = None) -> FakeRequest:
+        return self.service.request('calendar.events.patch', lambda: self.service.patch(eventId, body), fields)
+
+    def delete(self, calendarId: str, eventId: str) -> FakeRequest:
+        return self.service.request('calendar.events.delete', lambda: self.service.delete(eventId))
+
+    def list(self, calendarId: str, timeMin: str = None, timeMax: str = None, privateExtendedProperty: str = None,
+             singleEvents: bool = False, pageToken: str = None, maxResults: int = EVENTS_PAGE_SIZE, fields: str = None) -> FakeRequest:
+        return self.service.request(
+            'calendar.events.list', lambda: self.service.list(timeMin, timeMax, privateExtendedProperty, pageToken, maxResults), fields
+        )
+
+
+class FakeCalendarService(FakeGoogleService):
+    """A fake Google Calendar service with a single calendar."""
+
+    def __init__(self, backend: FakeBackend = None) -> None:
+        """Creates an empty calendar.
+
+        Parameters:
+            backend (FakeBackend): the simulated network. If not given, each round trip takes 50 ms and none fail.
+        """
+
+        super().__init__(backend)
+        self.items = {}
+
+    def events(self) -> FakeEventsResource:
+        return FakeEventsResource(self)
+
+    def insert(self, body: dict) -> dict:
+        with self.lock:
+            event = {'id': str(next(self.ids)), **copy.deepcopy(body)}
+            self.items[event['id']] = event
+            return copy.deepcopy(event)
+
+    def patch(self, event_id: str, body: dict) -> dict:
+        with self.lock:
+            if event_id not in self.items:
+                raise google_error(404)
+
+            self.items[event_id].update(copy.deepcopy(body))
+            return copy.deepcopy(self.items[event_id])
+
+    def delete(self, event_id: str) -> str:
+        with self.lock:
+            if self.items.pop(event_id, None) is None:
+                raise google_error(410)
+
+            return ''
+
+    def list(self, time_min: str, time_max: str, private_property: str, page_token: str, max_results: int) -> dict:
+        with self.lock:
+            events = copy.deepcopy(list(self.items.values()))
+
+        if private_property is not None:
+            key, value = private_property.split('=', 1)
+            events = [e for e in events if e.get('extendedProperties', {}).get('private', {}).get(key) == value]
+
+        if time_min is not None:
+            events = [e for e in events if parse_time(e['end']['dateTime']) > parse_time(time_min)]
+
+        if time_max is not None:
+            events = [e for e in events if parse_time(e['start']['dateTime']) < parse_time(time_max)]
+
+        start = int(page_token) if page_token is not None else 0
+        end = start + max_results
+        response = {'kind': 'calendar#events', 'items': events[start:end]}
+
+        if end < len(events):
+            response['nextPageToken'] = str(end)
+
+        return response
+
+
+class FakeAsanaTasks:
+    """The tasks resource of the fake Asana client."""
+
+    def __init__(self, client) -> None:
+        self.client = client
+
+    def get_tasks(self, params: dict, **options):
+        tasks = self.client.find_tasks(params.get('workspace'), params.get('completed_since'), params.get('modified_since'))
+        return self.client.collection(project(tasks, parse_opt_fields(params.get('opt_fields', []))), options)
+
+    def get_subtasks_for_task(self, gid: str, params: dict, **options):
+        return self.client.collection(project(self.client.find_subtasks(gid), parse_opt_fields(params.get('opt_fields', []))), options)
+
+    def update_task(self, gid: str, params: dict, **options) -> dict:
+        self.client.backend.round_trip()
+
+        if self.client.backend.should_fail():
+            raise asana_error()
+
+        return self.client.update(gid, params)
+
+
+class FakeAsanaClient:
+    """A fake Asana client holding one user's tasks and their subtasks."""
+
+    def __init__(self, tasks: list, subtasks: dict, backend: FakeBackend = None) -> None:
+        """Creates a client.
+
+        Parameters:
+            tasks (list): Asana tasks assigned to the user, from make_asana_tasks.
+            subtasks (dict): the subtasks of each task by task GID.
+            backend (FakeBackend): the simulated network. If not given, each round trip takes 50 ms and none fail.
+        """
+
+        self.backend = backend if backend is not None else FakeBackend()
+        self.lock = threading.Lock()
+        self.headers = {}
+        self.tasks = FakeAsanaTasks(self)
+
+        self.items = {task['gid']: copy.deepcopy(task) for task in tasks}
+        self.subtasks = {gid: [s['gid'] for s in task_subtasks] for gid, task_subtasks in subtasks.items()}
+
+        for task_subtasks in subtasks.values():
+            for subtask in task_subtasks:
+                self.items[subtask['gid']] = copy.deepcopy(subtask)
+
+    def find_tasks(self, workspace: str, completed_since: str, modified_since: str) -> list:
+        with self.lock:
+            subtask_gids = self.__subtask_gids()
+            tasks = [copy.deepcopy(self.items[gid]) for gid in self.items if gid not in subtask_gids]
+
+        tasks = [task for task in tasks if workspace is None or task.get('workspace', {}).get('gid', workspace) == workspace]
+
+        if completed_since == 'now':
+            tasks = [task for task in tasks if not task['completed']]
+        elif completed_since is not None:
+            since = datetime.fromisoformat(completed_since).replace(tzinfo=timezone.utc)
+            tasks = [task for task in tasks if not task['completed'] or parse_time(task['completed_at']) >= since]
+
+        if modified_since is not None:
+            tasks = [task for task in tasks if parse_time(task['modified_at']) >= parse_time(modified_since)]
+
+        return tasks
+
+    def find_subtasks(self, gid: str) -> list:
+        with self.lock:
+            return [copy.deepcopy(self.items[subtask_gid]) for subtask_gid in self.subtasks.get(gid, [])]
+
+    def update(self, gid: str, params: dict) -> dict:
+        with self.lock:
+            task = self.items[gid]
+            task.update(params)
+            task['modified_at'] = format_asana_time(datetime.now(timezone.utc))
+
+            if params.get('completed'):
+                task['completed_at'] = task['modified_at']
+
+            return copy.deepcopy(task)
+
+    def collection(self, items: list, options: dict):
+        """Return items like the Asana client does for a collection: an iterator over every page, or a single page with
+        the offset of the next if iterator_type is None."""
+
+        if options.get('iterator_type', 'items') is not None:
+            return self.pages(items)
+
+        self.backend.round_trip()
+
+        if self.backend.should_fail():
+            raise asana_error()
+
+        start = int(options['offset']) if options.get('offset') is not None else 0
+        end = start + min(options.get('limit') or ASANA_PAGE_SIZE, ASANA_PAGE_SIZE)
+        return {'data': items[start:end], 'next_page': {'offset': str(end)} if end < len(items) else None}
+
+    def pages(self, items: list):
+        """Yield items a page at a time, waiting for a round trip before each page like the Asana client does."""
+
+        for start in range(0, max(len(items), 1), ASANA_PAGE_SIZE):
+            self.backend.round_trip()
+
+            if self.backend.should_fail():
+                raise asana_error()
+
+            yield from items[start:start + ASANA_PAGE_SIZE]
+
+    def __subtask_gids(self) -> set:
+        return set(gid for subtask_gids in self.subtasks.values() for gid in subtask_gids)
+
+
+def make_asana_tasks(count: int, subtask_count: int = 5, subtask_ratio: float = 1, seed: int = 0, workspace_gids: list = None) -> tuple[list, dict]:
+    """Create random Asana tasks assigned to a user.
+
+    Parameters:
+        count (int): the number of tasks.
+        subtask_count (int): the number of subtasks of each task that has subtasks.
+        subtask_ratio (float): the share of tasks that have subtasks, from 0 to 1.
+        seed (int): the seed for the random tasks.
+        workspace_gids (list): the workspaces to spread the tasks across. If not given, tasks are in every workspace.
+
+    Returns:
+        tasks (list): the tasks. About one in ten has no due date.
+        subtasks (dict): the subtasks of each task by task GID.
+    """
+
+    rng = random.Random(seed)
+    today = date.today()
+    modified_at = format_asana_time(datetime.now(timezone.utc) - timedelta(days=7))
+
+    def make_task(gid, name, due_on):
+        return {
+            'gid': gid,
+            'name': name,
+            'due_on': due_on,
+            'completed': False,
+            'completed_at': None,
+            'modified_at': modified_at,
+            'custom_fields': [{'name': 'Estimate', 'number_value': rng.choice([None, 15, 30, 60, 90, 120])}],
+            'tags': []
+        }
+
+    tasks = []
+    subtasks = {}
+
+    for i in range(count):
+        gid = str(1000000 + i)
+        due_on = (today + timedelta(days=rng.randrange(-3, 30))).isoformat() if rng.random() > 0.1 else None
+        task_subtasks = subtask_count if rng.random() < subtask_ratio else 0
+
+        task = make_task(gid, f'Task {i}', due_on)
+        task['memberships'] = [{'project': {'name': f'Project {i % 7}'}, 'section': {'name': f'Section {i % 3}'}}]
+        task['num_subtasks'] = task_subtasks
+
+        if workspace_gids is not None:
+            task['workspace'] = {'gid': workspace_gids[i % len(workspace_gids)]}
+
+        tasks.append(task)
+
+        if task_subtasks != 0:
+            subtasks[gid] = [make_task(f'{gid}{j}', f'Subtask {j}', None) for j in range(task_subtasks)]
+
+    return tasks, subtasks
@@ -2,20 +2,37 @@
 
 import calendar
 import time
-import yaml
 
-from googleapiclient.discovery import build
-from httplib2 import Http
-from oauth2client import file, client, tools
-from datetime import timedelta, date
+import google_batch
+import google_services
+
+from datetime import timedelta, date, datetime
+
+RHYTHM_PROPERTY = 'rhythm'  # Private extended property that marks events created by Rhythm
+LIST_FIELDS = 'id,summary,colorId,start/dateTime,end/dateTime'  # Fields of each listed event that Rhythm reads
 
 
 class Calendar:
     """Represents a Google Calendar instance."""
 
-    def __init__(self) -> None:
-        """Initializes a Google Calendar instance."""
-        self.service = self.__get_service()
+    def __init__(self, color_id: int, service=None) -> None:
+        """Initializes a Google Calendar instance.
+
+        Parameters:
+            color_id (int): the color of created events.
+            service: an existing Calendar API service to use instead of creating a new one.
+        """
+        self.color_id = color_id
+        self.__service = service
+        self.scheduler = google_services.get_scheduler('calendar')
+
+    @property
+    def service(self):
+        """The Calendar API service, which is only created the first time it is used."""
+        if self.__service is None:
+            self.__service = google_services.get_service('calendar')
+
+        return self.__service
 
     @staticmethod
     def day_to_date(target_weekday: str) -> date:
@@ -60,74 +77,212 @@ class Calendar:
 
         return timezone
 
-    def __get_service(self):
-        """Get new Calendar API service instance.
-        
+    def insert_events(self, events: list) -> list:
+        """Insert events into the calendar using batch requests.
+
+        Parameters:
+            events (list): a list of Google Calendar event bodies.
+
         Returns:
-            service: a Google API service to interact with Google Calendar.
+            failures (list): a list of (event, exception) tuples for each event that could not be created.
         """
-        SCOPES = "https://www.googleapis.com/auth/calendar"
-        store = file.Storage('credentials/calendar_token.json')
-        creds = store.get()
+        requests = [self.service.events().insert(calendarId='primary', body=event, fields='id') for event in events]
+        _, errors = google_batch.execute_batch(self.scheduler, self.service, requests)
 
-        if not creds or creds.invalid:
-            flow = client.flow_from_clientsecrets('credentials/calendar.json', SCOPES)
-            creds = tools.run_flow(flow, store)
-        
-        service = build('calendar', 'v3', http=creds.authorize(Http()))
-        return service
+        failures = [(event, error) for event, error in zip(events, errors) if error is not None]
+        return failures
+
+    def list_rhythm_events(self, time_min: str, time_max: str) -> list:
+        """List the events created by Rhythm that overlap a time range.
+
+        Parameters:
+            time_min (str): the start of the range as a datetime string.
+            time_max (str): the end of the range as a datetime string.
+
+        Returns:
+            events (list): a list of Google Calendar events.
+        """
+        events = []
+        page_token = None
+
+        while True:
+            request = self.service.events().list(
+                calendarId='primary',
+                privateExtendedProperty=f'{RHYTHM_PROPERTY}=true',
+                timeMin=time_min,
+                timeMax=time_max,
+                singleEvents=True,
+                pageToken=page_token,
+                fields=f'nextPageToken,items({LIST_FIELDS})'
+            )
+            response = self.scheduler.execute(request.execute)
+
+            events += response.get('items', [])
+            page_token = response.get('nextPageToken')
+
+            if page_token is None:
+                return events
+
+    def list_day_events(self, dates: list) -> list:
+        """List the events created by Rhythm that start on the dates.
 
-    def load_schedule(self, schedule: str, weekday: str):
-        """Load the schedule into the weekday.
-        
         Parameters:
-            schedule (str): a list of each event on the schedule, separated by new lines.
-            weekday (str): a string representation of the weekday (ex: Monday).
+            dates (list): the dates to list events on.
+
+        Returns:
+            events (list): a list of Google Calendar events.
         """
-        date = self.day_to_date(weekday)
         timezone = self.get_timezone()
+        day_starts = {d: datetime.fromisoformat(f'{d}T00:00:00{timezone}:00') for d in dates}
 
-        with open('credentials/config.yml') as file:
-            config = yaml.safe_load(file)
-        
-        color_id = config['color_id']
-
-        # Create the list of events needed to be created
-        tasks = []
-        start_times = []
-        end_times = []
-        schedule_split = schedule.split('\n')
-
-        for t in range(len(schedule_split)):
-            if schedule_split[t] == '':
-                continue
-
-            line_split = schedule_split[t].split(', ')
-
-            tasks.append(line_split[0] + '')
-            start_times.append(f'{date}T{line_split[1].zfill(5)}:00{timezone}:00')
-            end_times.append(f'{date}T{line_split[2].zfill(5)}:00{timezone}:00')
-
-        # Last action ended at midnight of the next day
-        end_times[-1] = f'{date + timedelta(days=1)}T00:00:00{timezone}:00'
-
-        # Use the API to create the events
-        for t in range(len(tasks)):
-            event_body = {
-                'summary': tasks[t],
-                'colorId': color_id,
-                'start': {
-                    'dateTime': start_times[t],
-                },
-                'end': {
-                    'dateTime': end_times[t],
-                },
-                'reminders': {
-                    'useDefault': False,
-                    'overrides': [
-                        {'method': 'popup', 'minutes': 0},
-                    ]
-                },
-            }
-
-            self.service.events().insert(calendarId='primary', body=event_body).execute()
+        # List existing events over the whole range once, then keep the ones on the dates
+        time_min = day_starts[min(dates)].isoformat()
+        time_max = (day_starts[max(dates)] + timedelta(days=1)).isoformat()
+        events = []
+
+        for event in self.list_rhythm_events(time_min, time_max):
+            start = datetime.fromisoformat(event['start']['dateTime'])
+
+            if any(day_start <= start < day_start + timedelta(days=1) for day_start in day_starts.values()):
+                events.append(event)
+
+        return events
+
+    def sync_events(self, events: list, dates: list) -> list:
+        """Make the events created by Rhythm on the dates match the events given, only sending the changes needed.
+
+        Parameters:
+            events (list): a list of Google Calendar event bodies that should be on the dates.
+            dates (list): the dates to sync. Events created by Rhythm on these dates that are not in events are deleted.
+
+        Returns:
+            failures (list): a list of (event, exception) tuples for each event that could not be changed.
+        """
+        inserts, patches, deletes = diff_events(self.list_day_events(dates), events)
+
+        requests = [self.service.events().insert(calendarId='primary', body=event, fields='id') for event in inserts]
+        requests += [self.service.events().patch(calendarId='primary', eventId=event_id, body=body, fields='id') for event_id, body in patches]
+        requests += [self.service.events().delete(calendarId='primary', eventId=event['id']) for event in deletes]
+        changed = inserts + [body for _, body in patches] + deletes
+
+        if len(requests) == 0:
+            return []
+
+        _, errors = google_batch.execute_batch(self.scheduler, self.service, requests)
+
+        failures = [(event, error) for event, error in zip(changed, errors) if error is not None]
+        return failures
+
+
+def block_events(blocks: list, day: date, timezone: str, color_id: int) -> list:
+    """Create the event bodies for blocks of time on a date, without reading the date, timezone, or config.
+
+    Parameters:
+        blocks (list): (name, start, end) tuples of each event, with times in seconds since midnight.
+        day (date): the date of the events.
+        timezone (str): the timezone string from Calendar.get_timezone.
+        color_id (int): the color of the events.
+
+    Returns:
+        events (list): a list of Google Calendar event bodies.
+    """
+    midnight = datetime.combine(day, datetime.min.time())
+    events = []
+
+    for name, start, end in blocks:
+        # Times past the end of the day roll over into the next day
+        start_time = (midnight + timedelta(seconds=start)).isoformat()
+        end_time = (midnight + timedelta(seconds=end)).isoformat()
+
+        event_body = {
+            'summary': name,
+            'colorId': color_id,
+            'start': {
+                'dateTime': f'{start_time}{timezone}:00',
+            },
+            'end': {
+                'dateTime': f'{end_time}{timezone}:00',
+            },
+            'reminders': {
+                'useDefault': False,
+                'overrides': [
+                    {'method': 'popup', 'minutes': 0},
+                ]
+            },
+            'extendedProperties': {
+                'private': {RHYTHM_PROPERTY: 'true'},
+            },
+        }
+
+        events.append(event_body)
+
+    return events
+
+
+def diff_events(existing: list, events: list) -> tuple[list, list, list]:
+    """Find the smallest set of changes that turns the existing events into the new events.
+
+    Events with the same summary and times are kept. Remaining existing events are changed into new events, preferring
+    ones with the same summary, and anything left over is inserted or deleted.
+
+    Parameters:
+        existing (list): a list of Google Calendar events that are on the calendar.
+        events (list): a list of Google Calendar event bodies that should be on the calendar.
+
+    Returns:
+        inserts (list): event bodies to insert.
+        patches (list): (event ID, event body) tuples of events to change.
+        deletes (list): existing events to delete.
+    """
+
+    def event_key(event):
+        start = datetime.fromisoformat(event['start']['dateTime'])
+        end = datetime.fromisoformat(event['end']['dateTime'])
+        return event['summary'], start, end
+
+    # Group existing events by key so each can only be matched once
+    remaining = {}
+
+    for event in existing:
+        remaining.setdefault(event_key(event), []).append(event)
+
+    patches = []
+    unmatched = []
+
+    for event in events:
+        matches = remaining.get(event_key(event))
+
+        if matches:
+            match = matches.pop(0)
+
+            if str(match.get('colorId')) != str(event['colorId']):
+                patches.append((match['id'], event))
+        else:
+            unmatched.append(event)
+
+    # Move leftover existing events with the same summary instead of replacing them
+    leftovers = {}
+
+    for matches in remaining.values():
+        for event in matches:
+            leftovers.setdefault(event['summary'], []).append(event)
+
+    still_unmatched = []
+
+    for event in unmatched:
+        matches = leftovers.get(event['summary'])
+
+        if matches:
+            patches.append((matches.pop(0)['id'], event))
+        else:
+            still_unmatched.append(event)
+
+    # Reuse any other leftover events, since one patch is cheaper than an insert and a delete
+    deletes = [event for matches in leftovers.values() for event in matches]
+    reused = min(len(still_unmatched), len(deletes))
+
+    patches += [(deletes[i]['id'], still_unmatched[i]) for i in range(reused)]
+    inserts = still_unmatched[reused:]
+    deletes = deletes[reused:]
+
+    return inserts, patches, deletes
@@ -0,0 +1,124 @@
+"""Handles sending Google API requests in batches."""
+
+import time
+
+BATCH_SIZE = 50  # Google recommends at most 50 calls per batch
+MAX_ATTEMPTS = 3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+def is_retryable(exception: Exception) -> bool:
+    """Check if a failed request should be sent again.
+
+    Parameters:
+        exception (Exception): the exception the request failed with.
+
+    Returns:
+        retryable (bool): whether the request failed because of rate limits, a server error, or the connection.
+    """
+
+    from googleapiclient.errors import HttpError
+
+    if isinstance(exception, (ConnectionError, TimeoutError)):
+        return True
+
+    if not isinstance(exception, HttpError):
+        return False
+
+    status = exception.resp.status
+
+    if status == 403:
+        # Google sends rate limit errors as 403s with a rate limit reason
+        content = exception.content.decode('utf-8', 'ignore') if isinstance(exception.content, bytes) else str(exception.content)
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+
+    return status in RETRY_STATUSES
+
+
+def retry_after(exception: Exception) -> float:
+    """Find how long Google asked to wait before retrying a request.
+
+    Parameters:
+        exception (Exception): the exception the request failed with.
+
+    Returns:
+        seconds (float): the seconds from the Retry-After header, or None if there is no header.
+    """
+
+    from googleapiclient.errors import HttpError
+
+    if not isinstance(exception, HttpError) or exception.resp.get('retry-after') is None:
+        return None
+
+    try:
+        return float(exception.resp['retry-after'])
+    except ValueError:
+        return None
+
+
+def execute_batch(scheduler, service, requests: list, batch_size: int = BATCH_SIZE, max_attempts: int = MAX_ATTEMPTS) -> tuple[list, list]:
+    """Execute requests in batches, sending failed requests again if they can be retried.
+
+    Parameters:
+        scheduler (RequestScheduler): the scheduler to send the batches through. Its retry budget and backoff are used
+            when retrying failed requests from a batch, with each batch sent again using one retry.
+        service: the Google API service the requests were created from.
+        requests (list): a list of HttpRequests to execute.
+        batch_size (int): the most requests to send in one batch.
+        max_attempts (int): the most times to send each request.
+
+    Returns:
+        responses (list): the response of each request, or None if the request failed.
+        errors (list): the exception of each request, or None if the request succeeded.
+    """
+
+    from googleapiclient.errors import HttpError
+
+    responses = [None] * len(requests)
+    errors = [None] * len(requests)
+    pending = list(range(len(requests)))
+
+    def callback(request_id, response, exception):
+        index = int(request_id)
+        responses[index] = response
+        errors[index] = exception
+
+    def send_chunk(chunk):
+        batch = service.new_batch_http_request(callback=callback)
+
+        for index in chunk:
+            batch.add(requests[index], request_id=str(index))
+
+        batch.execute()
+        return [responses[index] for index in chunk]
+
+    for attempt in range(max_attempts):
+        if len(pending) == 0:
+            break
+
+        chunks = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+
+        if attempt > 0:
+            # Only retry the batches the retry budget allows, after backing off
+            chunks = [chunk for chunk in chunks if scheduler.spend_retry()]
+
+            if len(chunks) == 0:
+                break
+
+            time.sleep(scheduler.retry_delay(attempt - 1, errors[chunks[0][0]]))
+
+        for chunk in chunks:
+            try:
+                scheduler.execute(send_chunk, chunk, cost=len(chunk), operation='batch')
+            except HttpError as e:
+                # The whole batch failed, so mark every request in it as failed
+                for index in chunk:
+                    responses[index] = None
+                    errors[index] = e
+
+        sent = [index for chunk in chunks for index in chunk]
+        scheduler.refill_retries(sum(1 for index in sent if errors[index] is None))
+        pending = [index for index in sent if errors[index] is not None and is_retryable(errors[index])]
+
+    return responses, errors
@@ -0,0 +1,115 @@
+"""Handles creating Google API services that share one credential and transport layer."""
+
+import json
+import os
+import threading
+
+import google_batch
+import request_scheduler
+
+SERVICES = {
+    # Service name: (version, scopes, token path, client secrets path)
+    'calendar': ('v3', ['https://www.googleapis.com/auth/calendar'], 'credentials/calendar_token.json', 'credentials/calendar.json'),
+    'tasks': ('v1', ['https://www.googleapis.com/auth/tasks'], 'credentials/tasks_token.json', 'credentials/tasks.json'),
+}
+
+lock = threading.Lock()
+services = {}
+
+
+def get_credentials(scopes: list, token_path: str, client_secrets_path: str):
+    """Load saved Google credentials, refreshing them or letting the user log in if needed.
+
+    Parameters:
+        scopes (list): the scopes the credentials need.
+        token_path (str): the path the credentials are saved at.
+        client_secrets_path (str): the path to the OAuth client secrets, used if the user has to log in.
+
+    Returns:
+        credentials (Credentials): valid Google credentials.
+    """
+
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    creds = None
+
+    if os.path.exists(token_path):
+        with open(token_path) as file:
+            info = json.load(file)
+
+        # Tokens saved by oauth2client call the token access_token
+        if 'token' not in info and 'access_token' in info:
+            info['token'] = info['access_token']
+
+        creds = Credentials.from_authorized_user_info(info, scopes)
+
+    # If there are no (valid) credentials available, let the user log in.
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(client_secrets_path, scopes)
+            creds = flow.run_local_server(port=0)
+
+        # Save the credentials for the next run
+        with open(token_path, 'w') as token:
+            token.write(creds.to_json())
+
+    return creds
+
+
+def build_service(name: str, version: str, credentials):
+    """Build a Google API service from the discovery document bundled with the client library.
+
+    Each service gets its own authorized HTTP connection, which is kept open between requests. Connections are not
+    shared between services since they are not thread safe.
+
+    Parameters:
+        name (str): the name of the API.
+        version (str): the version of the API.
+        credentials (Credentials): the credentials to authorize requests with.
+
+    Returns:
+        service: a Google API service.
+    """
+
+    import google_auth_httplib2
+    import httplib2
+    from googleapiclient.discovery import build
+
+    http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+    return build(name, version, http=http, static_discovery=True, cache_discovery=False)
+
+
+def get_service(name: str):
+    """Get a Google API service, building it the first time it is needed.
+
+    Parameters:
+        name (str): the name of the API (calendar or tasks).
+
+    Returns:
+        service: a Google API service.
+    """
+
+    with lock:
+        if name not in services:
+            version, scopes, token_path, client_secrets_path = SERVICES[name]
+            credentials = get_credentials(scopes, token_path, client_secrets_path)
+            services[name] = build_service(name, version, credentials)
+
+        return services[name]
+
+
+def get_scheduler(name: str):
+    """Get the request scheduler shared by everything that sends requests to a Google API.
+
+    Parameters:
+        name (str): the name of the API (calendar or tasks).
+
+    Returns:
+        scheduler (RequestScheduler): the scheduler for the API.
+    """
+
+    return request_scheduler.get_scheduler(name, google_batch.is_retryable, google_batch.retry_after)
@@ -0,0 +1,179 @@
+"""Handles running long commands in the background so the command prompt stays usable."""
+
+import queue
+import threading
+import time
+import traceback
+
+
+class Cancelled(Exception):
+    """Raised inside a job when it is cancelled while running."""
+
+
+class Job:
+    """A command running in the background, with its progress and output."""
+
+    def __init__(self, job_id: int, name: str, function) -> None:
+        """Creates a queued job.
+
+        Parameters:
+            job_id (int): the number of the job.
+            name (str): a short description of the job (ex: reset monday).
+            function: the function to run. It is called with the job, so it can report progress and output and check if
+                it was cancelled.
+        """
+
+        self.id = job_id
+        self.name = name
+        self.function = function
+        self.status = 'queued'
+        self.progress = ''
+        self.output = []
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+    def report(self, progress: str) -> None:
+        """Set the progress shown for the job.
+
+        Parameters:
+            progress (str): a short description of what the job is doing (ex: 12 tasks fetched).
+        """
+
+        self.progress = progress
+
+    def log(self, message: str = '') -> None:
+        """Add a line to the job's output, which is shown with the jobs command.
+
+        Parameters:
+            message (str): the line to add.
+        """
+
+        self.output.append(message)
+
+    def check_cancelled(self) -> None:
+        """Raise Cancelled if the job was cancelled, so it stops at a safe point."""
+
+        if self.cancel_event.is_set():
+            raise Cancelled()
+
+    def elapsed(self) -> float:
+        """Get how many seconds the job has been running, or ran for if it finished."""
+
+        if self.started is None:
+            return 0
+
+        return (self.finished if self.finished is not None else time.monotonic()) - self.started
+
+
+class JobQueue:
+    """Runs jobs one at a time on a worker thread, in the order they were submitted.
+
+    Jobs run one at a time since resets share the same tasklist and calendar.
+    """
+
+    def __init__(self) -> None:
+        """Creates an empty queue and starts its worker thread."""
+
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self.__work, daemon=True)
+        self.worker.start()
+
+    def submit(self, name: str, function) -> Job:
+        """Queue a function to run in the background.
+
+        Parameters:
+            name (str): a short description of the job.
+            function: the function to run. It is called with the job.
+
+        Returns:
+            job (Job): the queued job.
+        """
+
+        with self.lock:
+            job = Job(self.next_id, name, function)
+            self.jobs[job.id] = job
+            self.next_id += 1
+
+        self.queue.put(job)
+        return job
+
+    def cancel(self, job_id: int) -> Job:
+        """Cancel a job. A queued job never starts, and a running job stops before its next step.
+
+        Parameters:
+            job_id (int): the number of the job.
+
+        Returns:
+            job (Job): the job, or None if there is no job with the number.
+        """
+
+        job = self.jobs.get(job_id)
+
+        if job is not None and job.status in ('queued', 'running'):
+            job.cancel_event.set()
+
+        return job
+
+    def active(self) -> list:
+        """Get the jobs that are queued or running.
+
+        Returns:
+            jobs (list): the jobs in the order they were submitted.
+        """
+
+        with self.lock:
+            return [job for job in self.jobs.values() if job.status in ('queued', 'running')]
+
+    def wait(self) -> None:
+        """Wait for every queued and running job to finish."""
+
+        self.queue.join()
+
+    def __work(self) -> None:
+        while True:
+            job = self.queue.get()
+
+            try:
+                if job.cancel_event.is_set():
+                    job.status = 'cancelled'
+                    continue
+
+                job.status = 'running'
+                job.started = time.monotonic()
+
+                try:
+                    job.function(job)
+                    job.status = 'done'
+                except Cancelled:
+                    job.status = 'cancelled'
+                except Exception as e:
+                    job.status = 'failed'
+                    job.error = e
+                    job.log(traceback.format_exc())
+                finally:
+                    job.finished = time.monotonic()
+            finally:
+                self.queue.task_done()
+
+
+def format_jobs(jobs: list) -> str:
+    """Format jobs as a table.
+
+    Parameters:
+        jobs (list): the jobs to show.
+
+    Returns:
+        table (str): a line for each job with its number, name, status, time, and progress.
+    """
+
+    if len(jobs) == 0:
+        return 'No jobs.'
+
+    width = max(len(job.name) for job in jobs)
+    lines = [f'{job.id:>3}  {job.name.ljust(width)}  {job.status:<9}  {job.elapsed():>6.1f}s  {job.progress}' for job in jobs]
+    return '\n'.join(lines)
@@ -0,0 +1,169 @@
+"""Handles keeping a record on disk of the changes a reset makes, so an interrupted reset can be finished later."""
+
+import json
+import os
+import threading
+from datetime import date
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'  # Failed operations are reported and not tried again, so they do not keep a journal unfinished
+
+
+class Journal:
+    """The operations a reset plans to make and which of them were made, saved to a file after each step.
+
+    Each operation has a kind (ex: insert), a key that identifies it within its kind, a body with what is needed to
+    make it again, and a state. Operations of a kind are kept in the order they were planned.
+    """
+
+    def __init__(self, path: str, days: list, dates: list, options: list, operations: dict = None, planned: str = None,
+                 abandoned: bool = False) -> None:
+        """Creates a journal.
+
+        Parameters:
+            path (str): the path to the JSON file to save the journal to.
+            days (list): string representations of the weekdays being reset (ex: monday).
+            dates (list): the dates of the days as ISO strings, since the same weekday is a different date each week.
+            options (list): command line options of the reset.
+            operations (dict): kind to a list of operations, each a dictionary with the keys key, body, and state.
+            planned (str): the date the operations were planned on as an ISO string. If not given, it is today.
+            abandoned (bool): whether the reset was cancelled, so its operations should not be finished.
+        """
+
+        self.path = path
+        self.days = list(days)
+        self.dates = list(dates)
+        self.options = list(options)
+        self.operations = operations if operations is not None else {}
+        self.planned = planned if planned is not None else date.today().isoformat()
+        self.abandoned = abandoned
+        self.lock = threading.Lock()  # Stages of a reset run at the same time and finish operations of different kinds
+
+    @classmethod
+    def load(cls, path: str):
+        """Read a journal saved by an earlier reset.
+
+        Parameters:
+            path (str): the path to the JSON file.
+
+        Returns:
+            journal (Journal): the saved journal, or None if there is no file.
+        """
+
+        if not os.path.exists(path):
+            return None
+
+        with open(path) as file:
+            saved = json.load(file)
+
+        return cls(path, saved['days'], saved.get('dates', []), saved['options'], saved['operations'], saved.get('planned', ''), saved.get('abandoned', False))
+
+    def add(self, kind: str, key: str, body) -> None:
+        """Plan an operation. Operations with a key that was already planned for the kind are skipped.
+
+        Parameters:
+            kind (str): the kind of the operation.
+            key (str): what identifies the operation, so making it twice can be avoided.
+            body: what is needed to make the operation, which is saved as JSON.
+        """
+
+        operations = self.operations.setdefault(kind, [])
+
+        if all(operation['key'] != key for operation in operations):
+            operations.append({'key': key, 'body': body, 'state': PENDING})
+
+    def pending(self, kind: str) -> list:
+        """Get the operations of a kind that were not made yet.
+
+        Parameters:
+            kind (str): the kind of the operations.
+
+        Returns:
+            operations (list): the pending operations in the order they were planned.
+        """
+
+        with self.lock:
+            return [operation for operation in self.operations.get(kind, []) if operation['state'] == PENDING]
+
+    def matches(self, dates: list, options: list) -> bool:
+        """Check whether the journal is for the same reset planned today, so finishing it replaces planning it again.
+
+        Parameters:
+            dates (list): the dates of the days being reset as ISO strings.
+            options (list): command line options of the reset.
+
+        Returns:
+            matches (bool): whether the reset was not cancelled, the dates and options are the same, and the operations
+                were planned today.
+        """
+
+        return not self.abandoned and self.dates == list(dates) and self.options == list(options) and self.planned == date.today().isoformat()
+
+    def pending_count(self) -> int:
+        """Count the operations of every kind that were not made yet."""
+
+        with self.lock:
+            return sum(operation['state'] == PENDING for operations in self.operations.values() for operation in operations)
+
+    def finish(self, kind: str, keys: list = None, failed_keys: list = ()) -> None:
+        """Mark pending operations as made and save the journal.
+
+        Parameters:
+            kind (str): the kind of the operations.
+            keys (list): the keys of the operations that were made. If not given, every pending operation of the kind was made.
+            failed_keys (list): the keys of the operations that failed, which are marked as failed instead.
+        """
+
+        keys = set(keys) if keys is not None else None
+        failed_keys = set(failed_keys)
+
+        with self.lock:
+            for operation in self.operations.get(kind, []):
+                if operation['state'] != PENDING:
+                    continue
+
+                if operation['key'] in failed_keys:
+                    operation['state'] = FAILED
+                elif keys is None or operation['key'] in keys:
+                    operation['state'] = DONE
+
+        self.save()
+
+    def save(self) -> None:
+        """Write the journal to its file, replacing the old file only once the new one is fully written."""
+
+        directory = os.path.dirname(self.path)
+
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with self.lock:
+            saved = json.dumps({
+                'days': self.days,
+                'dates': self.dates,
+                'options': self.options,
+                'planned': self.planned,
+                'abandoned': self.abandoned,
+                'operations': self.operations
+            })
+
+            # Write to another file first so a crash while writing cannot leave a broken journal
+            with open(f'{self.path}.tmp', 'w') as file:
+                file.write(saved)
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.replace(f'{self.path}.tmp', self.path)
+
+    def abandon(self) -> None:
+        """Mark the reset as cancelled and save the journal, so its pending operations are not finished later."""
+
+        self.abandoned = True
+        self.save()
+
+    def remove(self) -> None:
+        """Delete the journal's file once every operation has been made."""
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,14 +1,26 @@
 """Main program of Rhythm that displays a command prompt interface to interact with Rhythm."""
 
+import json
 import os
 import traceback
+from datetime import date
 
 import gcalendar
+import jobs
+import journal
+import metrics
+import pipeline
+import planner
 import rhythm_asana
+import ruleset_repository
 import schedule
 import tasks
 import yaml
 
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+OPTIONS = ['--no-cache', '--slots', '--plan', '--json']
+JOURNAL_PATH = 'cache/reset_journal.json'  # Changes planned by the last reset and which of them were made
+
 
 class Dash:
     def rulesets():
@@ -17,32 +29,54 @@ class Dash:
         current_screen = Rulesets
         return 0
 
-    def reset_day(day):
-        """Reset day schedule."""
-        # Get completed tasks and complete in Asana
-        completed_gids = google_tasks.get_completed_tasks()
-        asana.set_tasks(completed_gids)
+    def reset_day(day, *options):
+        """Reset day schedule in the background."""
+        submit_reset([day], options)
+        return 1
 
-        # Clear tasks
-        google_tasks.clear_tasks()
+    def reset_days(*days):
+        """Reset the schedules of several days at once in the background."""
+        options = [day for day in days if day.startswith('--')]
+        submit_reset([day for day in days if not day.startswith('--')], options)
+        return 1
 
-        # Create schedule and get Asana tasks
-        day_schedule, task_minutes = schedule.generate_schedule(f'current_rulesets/{day}.txt')
-        tasks = asana.get_tasks(day)
+    def reset_week(*options):
+        """Reset the schedule of every day that has a current ruleset in the background."""
+        days = [day for day in WEEKDAYS if os.path.exists(f'current_rulesets/{day}.txt')]
+        submit_reset(days, options)
+        return 1
 
-        # Get first tasks based on task minutes
-        task_hours = int(task_minutes / 60)
+    def jobs(job_id=None):
+        """List background jobs and their progress. Give a job number to also show its output."""
+        if job_id is None:
+            print(jobs.format_jobs(list(job_queue.jobs.values())))
+            return 1
 
-        if task_hours < len(tasks):
-            tasks = tasks[:task_hours]
-        
-        # Send tasks to Google Tasks and schedule to Google Calendar
-        for task in reversed(tasks):
-            google_tasks.add_task(task)
-        
-        calendar.load_schedule(day_schedule, day)
+        job = job_queue.jobs[int(job_id)]
+        print(jobs.format_jobs([job]))
+        print('\n' + '\n'.join(job.output))
+        return 1
+
+    def cancel(job_id):
+        """Cancel a background job. A running reset stops before its next step."""
+        job = job_queue.cancel(int(job_id))
+
+        if job is None:
+            print(f'No job {job_id}.')
+        elif job.cancel_event.is_set():
+            print(f'Job {job.id} cancelled.')
+        else:
+            print(f'Job {job.id} has already finished.')
+
+        return 1
+
+    def stats(*options):
+        """Show how many calls were made to each API and how long they took since Rhythm started. Add --clear to start counting again."""
+        print(metrics.format_stats())
+
+        if '--clear' in options:
+            metrics.reset()
 
-        print('\nDay reset.')
         return 1
 
 
@@ -52,9 +86,7 @@ class Rulesets:
         file_names = os.listdir('rulesets')
 
         for f in file_names:
-            with open(f'rulesets/{f}') as text:
-                name = text.read().split('\n')[0]
-                print(name)
+            print(ruleset_repository.read_name(f'rulesets/{f}'))
         
         return 2
 
@@ -63,12 +95,31 @@ class Rulesets:
         file_names = os.listdir('current_rulesets')
 
         for f in file_names:
-            with open(f'current_rulesets/{f}') as text:
-                name = text.read().split('\n')[0]
-                print(name)
+            print(ruleset_repository.read_name(f'current_rulesets/{f}'))
         
         return 2
 
+    def check_rulesets():
+        """Check every ruleset for mistakes, showing the line of each, and compile them so resets can load them quickly."""
+        issue_count = 0
+
+        for directory in ['rulesets', 'current_rulesets']:
+            for f in sorted(os.listdir(directory)):
+                path = f'{directory}/{f}'
+                ruleset = ruleset_repository.resolve_ruleset(path)
+
+                # Issues in the rulesets it extends or includes are shown when those are checked
+                lines = ruleset_repository.format_issues(path, ruleset._replace(issues=[issue for issue in ruleset.issues if issue.path == path]))
+                schedule.generate_blocks(path)
+
+                if len(lines) != 0:
+                    print('\n'.join(lines))
+                    issue_count += len(lines)
+
+        ruleset_repository.repository.save()
+        print(f'\n{issue_count} issues found.')
+        return 1
+
     def edit_ruleset(name):
         """List the documentation for a day ruleset."""
         print("""
@@ -76,6 +127,8 @@ class Rulesets:
             \n
             name, HH:MM (start), HH:MM (end)
             \n
+            @extends name / @include name (rulesets/name.txt)
+            \n
             Comments with #
         """)
 
@@ -90,6 +143,8 @@ class Rulesets:
             \n
             name, HH:MM (start), HH:MM (end)
             \n
+            @extends name / @include name (rulesets/name.txt)
+            \n
             Comments with #
         """)
 
@@ -103,10 +158,13 @@ class Rulesets:
 
         return 1
 
-    def new_ruleset(name):
-        """Make new day ruleset."""
+    def new_ruleset(name, base=None):
+        """Make new day ruleset. Give the name of another ruleset after the name to make it extend that ruleset."""
         with open(f'rulesets/{name}.txt', 'w') as f:
             f.write(f'{name}\n')
+
+            if base is not None:
+                f.write(f'@extends {base}\n')
         
         print('Ruleset created.')
         return 1
@@ -118,22 +176,322 @@ class Rulesets:
         return 0
 
 
+def check_reset(days: list, options: list) -> None:
+    """Check that the days, options, and rulesets of a reset are valid, raising a ValueError if not.
+
+    Parameters:
+        days (list): string representations of weekdays (ex: monday).
+        options (list): command line options.
+    """
+    if len(days) == 0:
+        raise ValueError('No days to reset. Give at least one day, or add rulesets to current_rulesets to reset the week')
+
+    for day in days:
+        if day not in WEEKDAYS:
+            raise ValueError(f'Unknown day {day}')
+
+    for option in options:
+        if option not in OPTIONS:
+            raise ValueError(f'Unknown option {option}')
+
+    # Catch mistakes in the rulesets before any requests are sent
+    errors = []
+
+    for day in days:
+        path = f'current_rulesets/{day}.txt'
+        ruleset = ruleset_repository.resolve_ruleset(path)
+        errors += [line for line, issue in zip(ruleset_repository.format_issues(path, ruleset), ruleset.issues) if issue.error]
+
+    if len(errors) != 0:
+        raise ValueError('Rulesets have errors:\n' + '\n'.join(errors))
+
+
+def submit_reset(days: list, options: list) -> None:
+    """Queue a reset of the days to run in the background, or a plan of the reset if --plan is given.
+
+    Parameters:
+        days (list): string representations of weekdays (ex: monday).
+        options (list): command line options, as for reset.
+    """
+    check_reset(days, options)
+
+    # Plans use the same services as resets, whose connections are not thread safe, so they are queued as jobs too
+    if '--plan' in options:
+        job = job_queue.submit(f'plan {" ".join(days)}', lambda job: preview_reset(days, options, job))
+    else:
+        job = job_queue.submit(f'reset {" ".join(days)}', lambda job: reset(days, options, job))
+
+    print(f'Queued job {job.id}: {job.name}. Use jobs to see its progress.')
+
+
+def plan_reset(days: list, options: list, run=None, read_events: bool = False) -> planner.Plan:
+    """Read what a reset of the days needs once and plan its changes, without changing anything.
+
+    Parameters:
+        days (list): string representations of weekdays in date order (ex: monday).
+        options (list): command line options, as for reset.
+        run: a function that runs a list of pipeline stages and returns their results. If not given, the stages are
+            run with pipeline.run_stages.
+        read_events (bool): whether to list the events on the calendar to plan exactly which events change. Resets
+            do not need this, since events are listed again when they are synced.
+
+    Returns:
+        plan (Plan): the changes of the reset.
+    """
+    use_cache = '--no-cache' not in options
+    use_slots = '--slots' in options
+    dates = [gcalendar.Calendar.day_to_date(day) for day in days]
+
+    if run is None:
+        run = lambda stages: pipeline.run_stages(stages)[0]
+
+    stages = [
+        pipeline.Stage('scan tasks', google_tasks.scan_tasks),
+        pipeline.Stage('generate schedules', lambda: {day: schedule.generate_blocks(f'current_rulesets/{day}.txt') for day in days}),
+        pipeline.Stage('get Asana tasks', lambda: asana.get_tasks(days[0], use_cache))
+    ]
+
+    if read_events:
+        stages.append(pipeline.Stage('list events', lambda: calendar.list_day_events(dates)))
+
+    results = run(stages)
+    completed_gids, listed_tasks = results['scan tasks']
+
+    return planner.plan_reset(
+        days, dates, results['generate schedules'], results['get Asana tasks'], completed_gids, listed_tasks,
+        calendar.get_timezone(), calendar.color_id, use_slots, results.get('list events')
+    )
+
+
+def preview_reset(days: list, options: list, job: jobs.Job = None) -> None:
+    """Show the changes a reset of the days would make with the calls it would send and how long they would take,
+    without changing anything.
+
+    Parameters:
+        days (list): string representations of weekdays (ex: monday).
+        options (list): command line options, as for reset. --json shows the plan as JSON.
+        job (Job): the background job the plan is made in. If given, the plan goes to the job's output and planning
+            stops between stages if the job is cancelled. Otherwise, the plan is printed.
+    """
+    check_reset(days, options)
+    log = job.log if job is not None else print
+    days = sorted(set(days), key=gcalendar.Calendar.day_to_date)
+
+    run = lambda stages: pipeline.run_stages(stages, check_cancelled=job.check_cancelled if job is not None else None)[0]
+    reset_plan = plan_reset(days, options, run, read_events=True)
+    estimates = planner.estimate_calls(reset_plan, metrics.mean_seconds())
+    ruleset_repository.repository.save()
+
+    if '--json' in options:
+        log(json.dumps(planner.plan_to_json(reset_plan, estimates), indent=2))
+        return
+
+    log(planner.format_plan(reset_plan, estimates))
+    previous = journal.Journal.load(JOURNAL_PATH)
+
+    if previous is not None and previous.abandoned:
+        log(f'\nThe cancelled reset of {", ".join(previous.dates)} has {previous.pending_count()} changes left. The next reset '
+              'drops it after completing its Asana tasks.')
+    elif previous is not None and previous.pending_count() != 0:
+        log(f'\nThe interrupted reset of {", ".join(previous.dates)} has {previous.pending_count()} changes left. Resetting the same '
+              'days today finishes it instead of planning again, and any other reset drops it after completing its Asana tasks.')
+
+
+def reset(days: list, options: list = (), job: jobs.Job = None) -> None:
+    """Reset the schedules of the days, fetching tasks from Asana and Google Tasks only once.
+
+    Tasks are packed into the Todo List blocks of the days in date order based on how long each takes, and all of the
+    days' events are sent to Google Calendar together.
+
+    Every change is planned before any is made and kept in a journal on disk, which records which changes were made. If
+    the last reset stopped without being cancelled and was for the same dates and options, planned today, only its
+    remaining changes are made. Any other unfinished journal was planned from data that is out of date, so only its Asana completions
+    are made and the rest is dropped before planning again.
+
+    Parameters:
+        days (list): string representations of weekdays (ex: monday).
+        options (list): command line options. --no-cache fetches every Asana task instead of using the cache, and
+            --slots puts each task on the calendar as its own event inside the Todo List blocks.
+        job (Job): the background job the reset is running in. If given, output and progress go to the job and the
+            reset stops between stages if the job is cancelled. Otherwise, output is printed.
+    """
+    check_reset(days, options)
+    log = job.log if job is not None else print
+    days = sorted(set(days), key=gcalendar.Calendar.day_to_date)
+    dates = [gcalendar.Calendar.day_to_date(day).isoformat() for day in days]
+
+    finished = []
+    progress = {}
+    timings = {}
+    known_subtasks = {}  # Subtasks fetched while planning, which are only trusted for the reset that fetched them
+
+    def run(stages):
+        def on_finish(name, result):
+            finished.append(name)
+
+            # Show how far along the reset is and what it has done so far
+            if name == 'scan tasks':
+                progress[name] = f'{len(result[0])} completed tasks found'
+            elif name == 'get Asana tasks':
+                progress[name] = f'{len(result)} tasks fetched'
+            elif name == 'sync events':
+                progress[name] = 'events synced'
+
+            if job is not None:
+                job.report(', '.join([f'{len(finished)} stages'] + list(progress.values())))
+
+        results, stage_timings = pipeline.run_stages(stages, on_finish=on_finish, check_cancelled=job.check_cancelled if job is not None else None)
+        timings.update(stage_timings)
+        return results
+
+    def plan():
+        reset_plan = plan_reset(days, options, run)
+        known_subtasks.update(asana.known_subtasks)
+
+        for day in days:
+            log(f'{day.capitalize()}: {len(reset_plan.placed[day])} tasks')
+
+        reset_journal = journal.Journal(JOURNAL_PATH, days, dates, options)
+
+        for kind, operations in reset_plan.operations.items():
+            for key, body in operations:
+                reset_journal.add(kind, key, body)
+
+        reset_journal.save()
+        return reset_journal
+
+    def apply(reset_journal, resumed=False):
+        def check_tasks():
+            # Inserts and deletes that were sent before the reset was interrupted may have been made without being
+            # marked, so the tasklist is checked for them. Tasks about to be deleted can have the same Asana GID as
+            # a task to insert, so they are not counted as inserted. Google leaves out empty notes, so tasks added by
+            # hand may have none.
+            delete_ids = {operation['key'] for operation in reset_journal.operations.get('delete', [])}
+            listed = list(google_tasks.list_tasks(fields='id,notes'))
+            listed_ids = {task['id'] for task in listed}
+            inserted_gids = {
+                planner.task_gid(task) for task in listed
+                if task['id'] not in delete_ids and len(task.get('notes', '').split('\n')) > 1
+            }
+
+            reset_journal.finish('delete', [operation['key'] for operation in reset_journal.pending('delete') if operation['key'] not in listed_ids])
+            reset_journal.finish('insert', [operation['key'] for operation in reset_journal.pending('insert') if operation['key'] in inserted_gids])
+
+        def complete_tasks(*_):
+            gids = [operation['body'] for operation in reset_journal.pending('complete')]
+            failures = asana.set_tasks(gids, known_subtasks) if len(gids) != 0 else []
+            failed_gids = {gid for gid, _ in failures}
+            reset_journal.finish('complete', failed_keys=[gid for gid in gids if gid.split(' ')[0] in failed_gids])
+            return failures
+
+        def clear_tasks(*_):
+            failures = google_tasks.clear_tasks([operation['body'] for operation in reset_journal.pending('delete')])
+            reset_journal.finish('delete', failed_keys=[task['id'] for task, _ in failures])
+            return failures
+
+        def add_tasks(*_):
+            failures = google_tasks.add_tasks([operation['body'] for operation in reset_journal.pending('insert')])
+            reset_journal.finish('insert', failed_keys=[planner.task_gid(task) for task, _ in failures])
+            return failures
+
+        def sync_events():
+            operations = reset_journal.pending('events')
+
+            if len(operations) == 0:
+                return []
+
+            # Syncing only sends the changes still needed, so days that were partly synced are finished
+            events = [event for operation in operations for event in operation['body']]
+            failures = calendar.sync_events(events, [date.fromisoformat(operation['key']) for operation in operations])
+            reset_journal.finish('events', failed_keys=[event['start']['dateTime'][:10] for event, _ in failures])
+            return failures
+
+        task_dependencies = ['check tasks'] if resumed else []
+        stages = [
+            pipeline.Stage('complete Asana tasks', complete_tasks),
+            pipeline.Stage('clear tasks', clear_tasks, task_dependencies),
+            pipeline.Stage('add tasks', add_tasks, ['clear tasks']),
+            pipeline.Stage('sync events', sync_events)
+        ]
+
+        if resumed:
+            stages.append(pipeline.Stage('check tasks', check_tasks))
+
+        # A cancelled reset is not finished by the next reset, unlike one that stopped because of a crash
+        try:
+            results = run(stages)
+        except jobs.Cancelled:
+            reset_journal.abandon()
+            raise
+
+        if reset_journal.pending_count() == 0:
+            reset_journal.remove()
+
+        for gid, error in results['complete Asana tasks']:
+            log(f'Could not complete Asana task {gid}: {error}')
+
+        for task, error in results['clear tasks']:
+            log(f'Could not delete task {task["title"]}: {error}')
+
+        for task, error in results['add tasks']:
+            log(f'Could not add task {task["title"]}: {error}')
+
+        for event, error in results['sync events']:
+            log(f'Could not update event {event["summary"]} at {event["start"]["dateTime"]}: {error}')
+
+    # Finish an interrupted reset of the same dates instead of planning it again
+    previous = journal.Journal.load(JOURNAL_PATH)
+    resumed = False
+
+    if previous is not None and previous.pending_count() != 0 and previous.matches(dates, options):
+        log(f'Finishing the interrupted reset of {", ".join(previous.days)} ({previous.pending_count()} changes left)')
+        apply(previous, resumed=True)
+        resumed = True
+    elif previous is not None:
+        # Tasks completed in Google Tasks are still complete, but the rest of the journal is out of date
+        log(f'Dropping the {"cancelled" if previous.abandoned else "unfinished"} reset of {", ".join(previous.dates)} planned on {previous.planned}')
+        gids = [operation['body'] for operation in previous.pending('complete')]
+
+        for gid, error in asana.set_tasks(gids) if len(gids) != 0 else []:
+            log(f'Could not complete Asana task {gid}: {error}')
+
+        previous.remove()
+
+    if not resumed:
+        apply(plan())
+
+    ruleset_repository.repository.save()
+    log(f'\n{pipeline.format_timings(timings)}')
+
+
 def main():
     global current_screen
     global asana
     global calendar
     global google_tasks
+    global job_queue
 
     current_screen = Dash
+    job_queue = jobs.JobQueue()
 
     # Get config and create Asana, Google Calendar, and Google Tasks handlers
     with open('credentials/config.yml') as file:
         config = yaml.safe_load(file)
 
-    asana = rhythm_asana.RhythmAsana(config['access_token'], config['assignee_gid'], config['workspace_gid'])
-    calendar = gcalendar.Calendar()
+    asana = rhythm_asana.RhythmAsana(
+        config['access_token'], config['assignee_gid'], config['workspace_gid'], cache_path='cache/asana.db',
+        duration_field=config.get('duration_field'), default_minutes=config.get('default_task_minutes', 60)
+    )
+    calendar = gcalendar.Calendar(config['color_id'])
     google_tasks = tasks.Tasks(config['tasklist_id'])
 
+    # Record call metrics unless turned off, and optionally trace every call
+    if config.get('metrics', True):
+        metrics.enable(config.get('trace_path'))
+
+    # Keep parsed rulesets between runs
+    ruleset_repository.repository = ruleset_repository.RulesetRepository('cache/rulesets.json')
+
     # Clear lambda
     clear = lambda: os.system('cls')
     clear()
@@ -153,6 +511,14 @@ def main():
         print(f'{current_screen.__name__} -----------------------------------')
         print(' ' + '\n '.join(current_commands))
         print('----------------------------------------')
+
+        # Show the progress of background jobs on the Dash screen
+        active_jobs = job_queue.active()
+
+        if current_screen is Dash and len(active_jobs) != 0:
+            print(jobs.format_jobs(active_jobs))
+            print('----------------------------------------')
+
         cmd = input('? ').split(' ')
 
         # Check if the command exists
@@ -161,8 +527,12 @@ def main():
             input('')
             continue
 
-        # Quit command
+        # Quit command, letting background jobs finish first
         if cmd[0] == 'quit':
+            if len(job_queue.active()) != 0:
+                print('Waiting for background jobs to finish...')
+                job_queue.wait()
+
             break
 
         # Get the arguments from the command
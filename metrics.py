@@ -0,0 +1,254 @@
+"""Handles recording how long calls take, how often they fail or are retried, and how much data they return."""
+
+import functools
+import json
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Upper bounds in seconds of each histogram bucket
+
+enabled = False
+lock = threading.Lock()
+stats = {}
+trace_file = None
+
+
+class Stat:
+    """Totals of every call recorded under one name."""
+
+    def __init__(self) -> None:
+        """Creates empty totals."""
+
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.seconds = 0
+        self.max_seconds = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # The last bucket is for calls slower than every bound
+
+    def percentile(self, fraction: float) -> float:
+        """Estimate a latency percentile from the histogram.
+
+        Parameters:
+            fraction (float): the percentile as a fraction (ex: 0.95).
+
+        Returns:
+            seconds (float): the upper bound of the bucket the percentile falls in, or the slowest call if it is past
+                every bound.
+        """
+
+        count = 0
+
+        for bound, bucket in zip(LATENCY_BUCKETS, self.buckets):
+            count += bucket
+
+            if count >= fraction * self.calls:
+                return min(bound, self.max_seconds)
+
+        return self.max_seconds
+
+
+class Span:
+    """Times a call as a context manager and records it when the call finishes."""
+
+    def __init__(self, name: str) -> None:
+        """Creates a span.
+
+        Parameters:
+            name (str): the name to record the call under (ex: asana.update_task).
+        """
+
+        self.name = name
+        self.bytes = 0
+        self.retries = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        record(self.name, time.perf_counter() - self.start, exception_type is not None, self.bytes, self.retries)
+
+    def add_retry(self) -> None:
+        """Count a retry of the call."""
+
+        self.retries += 1
+
+    def add_result(self, result) -> None:
+        """Count the size of a call's result as JSON.
+
+        Parameters:
+            result: the result of the call.
+        """
+
+        if result is not None:
+            self.bytes += len(json.dumps(result, default=str))
+
+
+class NullSpan:
+    """A span that records nothing, used when metrics are off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        pass
+
+    def add_retry(self) -> None:
+        pass
+
+    def add_result(self, result) -> None:
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def enable(trace_path: str = None) -> None:
+    """Start recording metrics.
+
+    Parameters:
+        trace_path (str): the path of a JSON lines file to append each call to. If not given, no trace is written.
+    """
+
+    global enabled
+    global trace_file
+
+    if trace_path is not None and os.path.dirname(trace_path) != '' and not os.path.exists(os.path.dirname(trace_path)):
+        os.makedirs(os.path.dirname(trace_path))
+
+    with lock:
+        if trace_file is not None:
+            trace_file.close()
+
+        trace_file = open(trace_path, 'a') if trace_path is not None else None
+        enabled = True
+
+
+def disable() -> None:
+    """Stop recording metrics and close the trace file."""
+
+    global enabled
+    global trace_file
+
+    with lock:
+        if trace_file is not None:
+            trace_file.close()
+
+        trace_file = None
+        enabled = False
+
+
+def span(name: str):
+    """Time a block of code as a call.
+
+    Parameters:
+        name (str): the name to record the call under.
+
+    Returns:
+        span (Span): a context manager that records the call when it exits, or one that does nothing if metrics are off.
+    """
+
+    return Span(name) if enabled else NULL_SPAN
+
+
+def timed(name: str):
+    """Decorate a function so each call to it is recorded.
+
+    Parameters:
+        name (str): the name to record calls under.
+
+    Returns:
+        decorator: a function decorator.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+
+            with Span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record(name: str, seconds: float, error: bool = False, size: int = 0, retries: int = 0) -> None:
+    """Add a call to the totals and the trace file.
+
+    Parameters:
+        name (str): the name of the call.
+        seconds (float): how long the call took.
+        error (bool): whether the call raised an exception.
+        size (int): the bytes the call returned.
+        retries (int): the times the call was retried.
+    """
+
+    with lock:
+        stat = stats.setdefault(name, Stat())
+        stat.calls += 1
+        stat.errors += int(error)
+        stat.retries += retries
+        stat.bytes += size
+        stat.seconds += seconds
+        stat.max_seconds = max(stat.max_seconds, seconds)
+        stat.buckets[sum(1 for bound in LATENCY_BUCKETS if seconds > bound)] += 1
+
+        if trace_file is not None:
+            trace_file.write(json.dumps({
+                'time': time.time(),
+                'name': name,
+                'seconds': seconds,
+                'error': error,
+                'bytes': size,
+                'retries': retries
+            }) + '\n')
+            trace_file.flush()
+
+
+def reset() -> None:
+    """Clear every recorded total."""
+
+    with lock:
+        stats.clear()
+
+
+def mean_seconds() -> dict:
+    """Get how long each call name took on average.
+
+    Returns:
+        latencies (dict): the mean seconds of each call name that was recorded.
+    """
+
+    with lock:
+        return {name: stat.seconds / stat.calls for name, stat in stats.items()}
+
+
+def format_stats() -> str:
+    """Format the totals of each call as a table.
+
+    Returns:
+        table (str): a line for each call name with its count, errors, retries, kilobytes, and latencies.
+    """
+
+    with lock:
+        rows = sorted(stats.items())
+
+    if len(rows) == 0:
+        return 'No calls recorded.'
+
+    width = max(len('call'), max(len(name) for name, _ in rows))
+    lines = [f'{"call".ljust(width)}  {"calls":>6}  {"errors":>6}  {"retries":>7}  {"KB":>8}  {"mean ms":>8}  {"p95 ms":>8}  {"max ms":>8}']
+
+    for name, stat in rows:
+        lines.append(
+            f'{name.ljust(width)}  {stat.calls:>6}  {stat.errors:>6}  {stat.retries:>7}  {stat.bytes / 1024:>8.1f}  '
+            f'{stat.seconds / stat.calls * 1000:>8.1f}  {stat.percentile(0.95) * 1000:>8.1f}  {stat.max_seconds * 1000:>8.1f}'
+        )
+
+    return '\n'.join(lines)
@@ -0,0 +1,115 @@
+"""Handles choosing which tasks fit into the Todo List time of a schedule."""
+
+import schedule
+
+
+def pack_tasks(durations: list, capacities: list) -> list:
+    """Put tasks into blocks of time in priority order, putting each task into the first block it fits in.
+
+    A task that does not fit is skipped so smaller, lower priority tasks can still fill the space left. The first
+    block with enough space is found with a segment tree of the most space left in each range of blocks, so packing
+    takes O(tasks * log(blocks)) time.
+
+    Parameters:
+        durations (list): the minutes each task takes, from highest to lowest priority.
+        capacities (list): the minutes of each block, in the order they should be filled.
+
+    Returns:
+        assignments (list): the index of the block each task was put in, or -1 if it did not fit in any block.
+    """
+
+    if len(capacities) == 0:
+        return [-1] * len(durations)
+
+    # Leaves start at size, and each node holds the most space left of its two children
+    size = 1
+
+    while size < len(capacities):
+        size *= 2
+
+    tree = [0] * (2 * size)
+    tree[size:size + len(capacities)] = capacities
+
+    for node in range(size - 1, 0, -1):
+        tree[node] = max(tree[2 * node], tree[2 * node + 1])
+
+    assignments = []
+
+    for duration in durations:
+        if duration > tree[1]:
+            assignments.append(-1)
+            continue
+
+        # Walk down to the leftmost block with enough space
+        node = 1
+
+        while node < size:
+            node = 2 * node if tree[2 * node] >= duration else 2 * node + 1
+
+        assignments.append(node - size)
+        tree[node] -= duration
+        node //= 2
+
+        while node >= 1:
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            node //= 2
+
+    return assignments
+
+
+def pack_schedule(tasks: list, blocks: list) -> tuple[list, list]:
+    """Fill the Todo List blocks of a schedule with tasks.
+
+    Parameters:
+        tasks (list): Rhythm tasks with the minutes each takes, from highest to lowest priority.
+        blocks (list): the blocks of the schedule.
+
+    Returns:
+        placed (list): (task, block) tuples of each task that fit and the Todo List block it is in, in priority order.
+        remaining (list): the tasks that did not fit, in priority order.
+    """
+
+    todo_blocks = [block for block in blocks if block.name == schedule.TODO_LIST]
+    capacities = [(block.end - block.start) // 60 for block in todo_blocks]
+    assignments = pack_tasks([task['minutes'] for task in tasks], capacities)
+
+    placed = [(task, todo_blocks[a]) for task, a in zip(tasks, assignments) if a != -1]
+    remaining = [task for task, a in zip(tasks, assignments) if a == -1]
+    return placed, remaining
+
+
+def schedule_tasks(blocks: list, placed: list) -> list:
+    """Give each placed task its own block of time at the start of its Todo List block, in priority order.
+
+    Parameters:
+        blocks (list): the blocks of the schedule.
+        placed (list): (task, block) tuples from pack_schedule.
+
+    Returns:
+        blocks (list): the blocks of the schedule with each Todo List block split into a block for each of its tasks,
+            followed by a Todo List block for any time left over.
+    """
+
+    block_tasks = {}
+
+    for task, block in placed:
+        block_tasks.setdefault(block, []).append(task)
+
+    scheduled = []
+
+    for block in blocks:
+        if block not in block_tasks:
+            scheduled.append(block)
+            continue
+
+        start = block.start
+
+        for task in block_tasks[block]:
+            end = start + task['minutes'] * 60
+            scheduled.append(schedule.Block(task['title'], start, end))
+            start = end
+
+        if start < block.end:
+            scheduled.append(schedule.Block(schedule.TODO_LIST, start, block.end))
+
+    return scheduled
@@ -0,0 +1,92 @@
+"""Handles running stages of work concurrently based on what they depend on."""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Stage:
+    """A step of work that can run once the stages it depends on have finished."""
+
+    def __init__(self, name: str, function, dependencies: list = None) -> None:
+        """Creates a stage.
+
+        Parameters:
+            name (str): the name of the stage.
+            function: the function to run. It is called with the result of each dependency, in the order they are listed.
+            dependencies (list): the names of the stages that have to finish before this stage runs.
+        """
+
+        self.name = name
+        self.function = function
+        self.dependencies = dependencies if dependencies is not None else []
+
+
+def run_stages(stages: list, max_workers: int = 4, on_finish=None, check_cancelled=None) -> tuple[dict, dict]:
+    """Run each stage on a thread pool as soon as all of its dependencies have finished.
+
+    If a stage raises an exception, no new stages are started, the running stages are waited on, and the exception is raised.
+
+    Parameters:
+        stages (list): the stages to run.
+        max_workers (int): the most stages to run at once.
+        on_finish: a function called with the name and result of each stage when it finishes.
+        check_cancelled: a function called before starting stages, which raises an exception to stop the run in the
+            same way as a failed stage.
+
+    Returns:
+        results (dict): the result of each stage by name.
+        timings (dict): the seconds each stage took to run by name.
+    """
+
+    results = {}
+    timings = {}
+    pending = list(stages)
+    running = {}
+
+    def run(stage: Stage, args: list) -> tuple:
+        start = time.perf_counter()
+        result = stage.function(*args)
+        return result, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(pending) != 0 or len(running) != 0:
+            # Start every stage whose dependencies are done
+            ready = [stage for stage in pending if all(d in results for d in stage.dependencies)]
+
+            if len(ready) != 0 and check_cancelled is not None:
+                check_cancelled()
+
+            for stage in ready:
+                pending.remove(stage)
+                args = [results[d] for d in stage.dependencies]
+                running[executor.submit(run, stage, args)] = stage
+
+            if len(running) == 0:
+                names = ', '.join(stage.name for stage in pending)
+                raise ValueError(f'Stages have missing or circular dependencies: {names}')
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name], timings[stage.name] = future.result()
+
+                if on_finish is not None:
+                    on_finish(stage.name, results[stage.name])
+
+    return results, timings
+
+
+def format_timings(timings: dict) -> str:
+    """Format stage timings into a table, in the order the stages finished.
+
+    Parameters:
+        timings (dict): the seconds each stage took to run by name.
+
+    Returns:
+        table (str): a line for each stage with its name and time.
+    """
+
+    width = max([len(name) for name in timings] + [5])
+    lines = [f'{name.ljust(width)}  {seconds:.2f}s' for name, seconds in timings.items()]
+    return '\n'.join(lines)
@@ -0,0 +1,253 @@
+"""Handles planning the changes a reset makes from data that was already read.
+
+Nothing here reads files or sends requests, so a plan can be made, shown, or benchmarked apart from the calls that read
+what it needs and the calls that make its changes.
+"""
+
+import math
+from datetime import datetime
+from typing import NamedTuple
+
+import gcalendar
+import google_batch
+import packing
+import request_scheduler
+import schedule
+import tasks
+from rhythm_asana import MAX_WORKERS as ASANA_WORKERS
+
+DEFAULT_LATENCY = 0.2  # Seconds a call is expected to take when no call of its kind has been recorded
+
+
+class Plan(NamedTuple):
+    """The changes a reset would make."""
+
+    days: list  # String representations of the weekdays, in date order
+    placed: dict  # Day to (task, block) tuples of each task put in the day's Todo List blocks
+    operations: dict  # Kind (complete, delete, insert, or events) to (key, body) tuples in the order they are made
+    event_changes: tuple = None  # (inserts, patches, deletes) from gcalendar.diff_events, if the calendar was read
+
+
+def task_gid(task: dict) -> str:
+    """Get the GID line of a Rhythm task or Google Tasks task, which is the task GID or the subtask and task GIDs.
+
+    Parameters:
+        task (dict): a task with notes.
+
+    Returns:
+        gid (str): the second line of the task's notes.
+    """
+
+    return task['notes'].split('\n')[1]
+
+
+def pack_days(days: list, schedules: dict, rhythm_tasks: list) -> dict:
+    """Fill each day's Todo List blocks in date order, with the tasks that did not fit moving on to the next day.
+
+    Parameters:
+        days (list): string representations of the weekdays, in date order.
+        schedules (dict): the blocks of each day.
+        rhythm_tasks (list): Rhythm tasks from highest to lowest priority.
+
+    Returns:
+        placed (dict): (task, block) tuples from packing.pack_schedule for each day.
+    """
+
+    placed = {}
+
+    for day in days:
+        placed[day], rhythm_tasks = packing.pack_schedule(rhythm_tasks, schedules[day])
+
+    return placed
+
+
+def plan_reset(days: list, dates: list, schedules: dict, rhythm_tasks: list, completed_gids: list, listed_tasks: list,
+               timezone: str, color_id: int, use_slots: bool = False, existing_events: list = None) -> Plan:
+    """Plan the changes of a reset.
+
+    Tasks completed in Google Tasks are left out of the Asana tasks, since they are only completed in Asana once the
+    plan is made. Each operation is keyed by what identifies it on its service, so a journal of the plan can tell which
+    were made.
+
+    Parameters:
+        days (list): string representations of the weekdays, in date order.
+        dates (list): the date of each day.
+        schedules (dict): the blocks of each day.
+        rhythm_tasks (list): the Rhythm tasks from RhythmAsana.get_tasks.
+        completed_gids (list): the GIDs of tasks completed in Google Tasks, from Tasks.scan_tasks.
+        listed_tasks (list): every task in the tasklist, from Tasks.scan_tasks.
+        timezone (str): the timezone string from Calendar.get_timezone.
+        color_id (int): the color of the events.
+        use_slots (bool): whether each task gets its own event inside the Todo List blocks.
+        existing_events (list): the events created by Rhythm on the dates. If given, the calendar changes are planned too.
+
+    Returns:
+        plan (Plan): the changes of the reset.
+    """
+
+    completed = set(completed_gids)
+    placed = pack_days(days, schedules, [task for task in rhythm_tasks if task_gid(task) not in completed])
+
+    operations = {
+        'complete': [(gid, gid) for gid in dict.fromkeys(completed_gids)],
+        'delete': [(task['id'], {'id': task['id'], 'title': task['title']}) for task in listed_tasks],
+        'insert': [(task_gid(task), task) for day in days for task, _ in placed[day]],
+        'events': []
+    }
+
+    events = []
+
+    for day, date in zip(days, dates):
+        blocks = packing.schedule_tasks(schedules[day], placed[day]) if use_slots else schedules[day]
+        day_events = gcalendar.block_events(blocks, date, timezone, color_id)
+        operations['events'].append((date.isoformat(), day_events))
+        events += day_events
+
+    event_changes = gcalendar.diff_events(existing_events, events) if existing_events is not None else None
+    return Plan(days, placed, operations, event_changes)
+
+
+def estimate_calls(plan: Plan, latencies: dict = None) -> dict:
+    """Estimate the calls that making a plan sends and how long they take.
+
+    Parameters:
+        plan (Plan): the plan.
+        latencies (dict): the mean seconds of each call name from earlier calls. Calls that are not in it are expected
+            to take DEFAULT_LATENCY.
+
+    Returns:
+        estimates (dict): (calls, seconds) tuples of each call name. Calls of a service are limited by its rate as well
+            as by how many can be in flight at once.
+    """
+
+    latencies = latencies if latencies is not None else {}
+    estimates = {}
+
+    def add(name, calls, in_flight=1, cost=None):
+        if calls == 0:
+            return
+
+        # The scheduler lets a burst of requests through, then charges each batch its full cost at its rate
+        rate, burst, _ = request_scheduler.SERVICES[name.split('.')[0]]
+        throttled = max(0, ((cost if cost is not None else calls) - burst) / rate)
+        estimates[name] = (calls, max(math.ceil(calls / in_flight) * latencies.get(name, DEFAULT_LATENCY), throttled))
+
+    # A task whose subtasks were completed has its subtasks fetched to check if it is complete too
+    keys = [key for key, _ in plan.operations['complete']]
+    completed = {key.split(' ')[0] for key in keys}
+    parents = {key.split(' ')[1] for key in keys if ' ' in key} - completed
+    add('asana.update_task', len(completed), ASANA_WORKERS)
+    add('asana.get_subtasks', len(parents), ASANA_WORKERS)
+
+    deletes = len(plan.operations['delete'])
+    inserts = len(plan.operations['insert'])
+    batches = math.ceil(deletes / google_batch.BATCH_SIZE) + math.ceil(inserts / google_batch.BATCH_SIZE)
+    add('tasks.batch', batches, cost=deletes + inserts)
+    add('tasks.tasks.list', math.ceil(inserts / tasks.LIST_PAGE_SIZE) if inserts >= 2 else 0)  # Checking the order
+
+    if plan.event_changes is not None:
+        changes = sum(len(changed) for changed in plan.event_changes)
+    else:
+        changes = sum(len(events) for _, events in plan.operations['events'])  # At most every event changes
+
+    add('calendar.events.list', 1)
+    add('calendar.batch', math.ceil(changes / google_batch.BATCH_SIZE), cost=changes)
+    return estimates
+
+
+def estimate_seconds(estimates: dict) -> float:
+    """Estimate how long making a plan takes. Each service's calls are sent one after another, and the services are
+    sent to at the same time.
+
+    Parameters:
+        estimates (dict): the estimates from estimate_calls.
+
+    Returns:
+        seconds (float): the expected seconds.
+    """
+
+    services = {}
+
+    for name, (_, seconds) in estimates.items():
+        service = name.split('.')[0]
+        services[service] = services.get(service, 0) + seconds
+
+    return max(services.values(), default=0)
+
+
+def format_plan(plan: Plan, estimates: dict) -> str:
+    """Format a plan as text.
+
+    Parameters:
+        plan (Plan): the plan.
+        estimates (dict): the estimates from estimate_calls.
+
+    Returns:
+        text (str): each change, followed by the estimated calls and time.
+    """
+
+    def event_line(event):
+        start = datetime.fromisoformat(event['start']['dateTime'])
+        end = datetime.fromisoformat(event['end']['dateTime'])
+        return f'{event["summary"]}, {start:%a %H:%M} - {end:%a %H:%M}'
+
+    lines = [f'Plan for {", ".join(plan.days)}', '']
+
+    lines.append(f'Complete in Asana: {len(plan.operations["complete"])}')
+    lines += [f'  {gid}' for gid, _ in plan.operations['complete']]
+
+    lines.append(f'Delete from Google Tasks: {len(plan.operations["delete"])}')
+    lines += [f'  {task["title"]}' for _, task in plan.operations['delete']]
+
+    lines.append(f'Add to Google Tasks: {len(plan.operations["insert"])}')
+
+    for day in plan.days:
+        lines.append(f'  {day.capitalize()}: {len(plan.placed[day])}')
+        lines += [f'    {task["title"]} ({task["minutes"]} min, {block.name} {schedule.seconds_to_time(block.start)})' for task, block in plan.placed[day]]
+
+    if plan.event_changes is not None:
+        inserts, patches, deletes = plan.event_changes
+        lines.append(f'Calendar: {len(inserts)} to add, {len(patches)} to change, {len(deletes)} to delete')
+        lines += [f'  + {event_line(event)}' for event in inserts]
+        lines += [f'  ~ {event_line(event)}' for _, event in patches]
+        lines += [f'  - {event_line(event)}' for event in deletes]
+    else:
+        lines.append(f'Calendar: {sum(len(events) for _, events in plan.operations["events"])} events to sync')
+
+    lines += ['', f'{"call".ljust(24)}  {"calls":>6}  {"seconds":>8}']
+    lines += [f'{name.ljust(24)}  {calls:>6}  {seconds:>8.1f}' for name, (calls, seconds) in sorted(estimates.items())]
+    lines.append(f'Expected time: {estimate_seconds(estimates):.1f}s')
+
+    return '\n'.join(lines)
+
+
+def plan_to_json(plan: Plan, estimates: dict) -> dict:
+    """Convert a plan to a dictionary that can be written as JSON.
+
+    Parameters:
+        plan (Plan): the plan.
+        estimates (dict): the estimates from estimate_calls.
+
+    Returns:
+        plan (dict): the changes of the plan by kind, with the estimated calls and seconds.
+    """
+
+    converted = {
+        'days': plan.days,
+        'complete': [gid for gid, _ in plan.operations['complete']],
+        'delete': [task for _, task in plan.operations['delete']],
+        'insert': [task for _, task in plan.operations['insert']],
+        'events': {date: events for date, events in plan.operations['events']},
+        'calls': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in estimates.items()},
+        'seconds': estimate_seconds(estimates)
+    }
+
+    if plan.event_changes is not None:
+        inserts, patches, deletes = plan.event_changes
+        converted['event_changes'] = {
+            'insert': inserts,
+            'patch': [{'id': event_id, 'body': body} for event_id, body in patches],
+            'delete': [event['id'] for event in deletes]
+        }
+
+    return converted
@@ -0,0 +1,184 @@
+"""Handles sending API requests within each service's rate limits, retrying requests that fail."""
+
+import random
+import threading
+import time
+
+import metrics
+
+SERVICES = {
+    # Service name: (requests per second, burst size, most requests in flight at once)
+    'asana': (25, 50, 15),  # Asana allows 1500 requests per minute and 15 concurrent writes
+    'calendar': (10, 20, 8),
+    'tasks': (10, 20, 8),
+}
+
+MAX_ATTEMPTS = 5  # Most times to send one request
+RETRY_BUDGET = 20  # Most retries to have saved up for a service
+RETRY_REFILL = 0.1  # Retries saved up for each request that succeeds
+BASE_DELAY = 0.5  # Seconds to wait before the first retry, doubled for each retry after
+MAX_DELAY = 30  # Most seconds to wait before a retry
+
+lock = threading.Lock()
+schedulers = {}
+
+
+class TokenBucket:
+    """Limits how fast requests are sent, while letting short bursts through."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """Creates a full token bucket.
+
+        Parameters:
+            rate (float): the tokens added each second.
+            capacity (float): the most tokens the bucket can hold.
+        """
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Take tokens from the bucket, waiting until there are enough.
+
+        Parameters:
+            tokens (float): the tokens to take. The bucket can go into debt, so requests that cost more than there are
+                tokens wait for the rest to be added, and the requests after them wait for the debt to be paid off.
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - tokens
+            self.updated = now
+            wait = -self.tokens / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RequestScheduler:
+    """Sends requests to one service, limiting their rate and concurrency and retrying them with backoff."""
+
+    def __init__(self, name: str, rate: float, burst: float, max_concurrency: int, is_retryable, retry_after=None) -> None:
+        """Creates a scheduler.
+
+        Parameters:
+            name (str): the name of the service.
+            rate (float): the most requests to send each second on average.
+            burst (float): the most requests to send at once after being idle.
+            max_concurrency (int): the most requests to have in flight at once.
+            is_retryable: a function that takes an exception and returns whether the request should be sent again.
+            retry_after: a function that takes an exception and returns the seconds the service asked to wait, or None.
+        """
+
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.is_retryable = is_retryable
+        self.retry_after = retry_after if retry_after is not None else lambda e: None
+
+        self.budget_lock = threading.Lock()
+        self.retry_budget = RETRY_BUDGET
+
+    def execute(self, function, *args, cost: float = 1, operation: str = None, **kwargs):
+        """Call a function that sends a request, retrying it if it fails in a way that can be retried.
+
+        Parameters:
+            function: the function to call.
+            args: the arguments to call it with.
+            cost (float): the amount of the rate limit the request uses, like the number of requests in a batch.
+            operation (str): the name to record the request's metrics under. If not given, the name of the API method
+                or the function is used.
+            kwargs: the keyword arguments to call it with.
+
+        Returns:
+            result: the result of the function.
+        """
+
+        if operation is None:
+            # Google API requests know the method they call, like calendar.events.list
+            method_id = getattr(getattr(function, '__self__', None), 'methodId', None)
+            operation = method_id.split('.', 1)[-1] if method_id is not None else function.__name__
+
+        with metrics.span(f'{self.name}.{operation}') as span:
+            for attempt in range(MAX_ATTEMPTS):
+                self.bucket.acquire(cost)
+
+                try:
+                    with self.semaphore:
+                        result = function(*args, **kwargs)
+                except Exception as e:
+                    if attempt == MAX_ATTEMPTS - 1 or not self.is_retryable(e) or not self.spend_retry():
+                        raise
+
+                    span.add_retry()
+                    time.sleep(self.retry_delay(attempt, e))
+                    continue
+
+                self.refill_retries()
+                span.add_result(result)
+                return result
+
+    def retry_delay(self, attempt: int, exception: Exception = None) -> float:
+        """Find how long to wait before retrying a request.
+
+        Parameters:
+            attempt (int): the number of times the request has been sent before, starting at 0.
+            exception (Exception): the exception the request failed with.
+
+        Returns:
+            delay (float): the seconds the service asked to wait, or an exponential backoff with full jitter.
+        """
+
+        retry_after = self.retry_after(exception) if exception is not None else None
+
+        if retry_after is not None:
+            return retry_after + random.random()
+
+        return random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt)))
+
+    def spend_retry(self) -> bool:
+        """Use one retry from the retry budget, so a failing service is not flooded with retries.
+
+        Returns:
+            allowed (bool): whether there was a retry left to use.
+        """
+
+        with self.budget_lock:
+            if self.retry_budget < 1:
+                return False
+
+            self.retry_budget -= 1
+            return True
+
+    def refill_retries(self, requests: int = 1) -> None:
+        """Save up retries for requests that succeeded.
+
+        Parameters:
+            requests (int): the number of requests that succeeded.
+        """
+
+        with self.budget_lock:
+            self.retry_budget = min(RETRY_BUDGET, self.retry_budget + (requests * RETRY_REFILL))
+
+
+def get_scheduler(name: str, is_retryable, retry_after=None) -> RequestScheduler:
+    """Get the scheduler shared by everything that sends requests to a service, creating it the first time.
+
+    Parameters:
+        name (str): the name of the service in SERVICES.
+        is_retryable: a function that takes an exception and returns whether the request should be sent again.
+        retry_after: a function that takes an exception and returns the seconds the service asked to wait, or None.
+
+    Returns:
+        scheduler (RequestScheduler): the scheduler for the service.
+    """
+
+    with lock:
+        if name not in schedulers:
+            rate, burst, max_concurrency = SERVICES[name]
+            schedulers[name] = RequestScheduler(name, rate, burst, max_concurrency, is_retryable, retry_after)
+
+        return schedulers[name]
@@ -1,64 +1,192 @@
 """Handles getting tasks from and writing to Asana."""
 
-import asana
-from datetime import datetime, timedelta
+import heapq
+import os
+import re
+import request_scheduler
+import threading
+from asana_cache import TaskCache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from gcalendar import Calendar
 
+MAX_WORKERS = 8  # Most requests to have in flight at once
+PAGE_SIZE = 100  # Most items Asana returns in one page
+FULL_SYNC_HOURS = 24  # Hours before the cache is fully refreshed, to catch tasks that are no longer assigned
+DURATION_TAG = re.compile(r'^(\d+(?:\.\d+)?)\s*(m|min|h|hr)$')  # Tags like 30m or 1.5h
+
+
+def is_retryable(exception: Exception) -> bool:
+    """Check if a failed Asana request should be sent again.
+
+    Parameters:
+        exception (Exception): the exception the request failed with.
+
+    Returns:
+        retryable (bool): whether the request hit the rate limit or failed on the server.
+    """
+
+    import asana
+
+    return isinstance(exception, (asana.error.RateLimitEnforcedError, asana.error.ServerError))
+
+
+def retry_after(exception: Exception) -> float:
+    """Find how long Asana asked to wait before retrying a request.
+
+    Parameters:
+        exception (Exception): the exception the request failed with.
+
+    Returns:
+        seconds (float): the seconds Asana asked to wait, or None if it did not say.
+    """
+
+    return getattr(exception, 'retry_after', None)
+
+
 class RhythmAsana:
     """Class that handles reading and writing from Asana."""
 
-    def __init__(self, access_token: str, assignee_gid: str, workspace_gid: str) -> None:
-        """Initializes an instance with a connection to Asana.
+    def __init__(self, access_token: str, assignee_gid, workspace_gid, count_subtasks: bool = True, cache_path: str = None,
+                 duration_field: str = None, default_minutes: int = 60, client=None) -> None:
+        """Initializes an instance. The connection to Asana is only made the first time it is used.
         
         Parameters:
             access_token (str): access token for Asana.
-            assignee_gid (str): user's assignee GID in Asana.
-            workspace_gid (str): workspace GID to access.
+            assignee_gid (str or list): user's assignee GID in Asana, or a list of them to get the tasks of several people.
+            workspace_gid (str or list): workspace GID to access, or a list of them to get tasks from several workspaces.
+            count_subtasks (bool): if True, only get subtasks for tasks that Asana reports as having subtasks.
+            cache_path (str): the path to cache tasks at. If not given, tasks are not cached. With several assignees
+                or workspaces, each pair gets its own cache next to this path.
+            duration_field (str): the name of a number custom field holding the minutes each task takes.
+            default_minutes (int): the minutes a task takes if it has no duration field or duration tag.
+            client: an existing Asana client to use instead of creating a new one.
         """
 
-        self.client = asana.Client.access_token(access_token)
-        self.client.headers = {'asana-enable': 'new_user_task_lists'}  # Supress warning
+        self.access_token = access_token
+        self.__client = client
+        self.__client_lock = threading.Lock()
+
+        # Tasks are fetched for every assignee in every workspace
+        assignee_gids = assignee_gid if isinstance(assignee_gid, list) else [assignee_gid]
+        workspace_gids = workspace_gid if isinstance(workspace_gid, list) else [workspace_gid]
+        self.sources = [(assignee, workspace) for workspace in workspace_gids for assignee in assignee_gids]
+
+        self.count_subtasks = count_subtasks
+        self.caches = {}
+
+        if cache_path is not None:
+            for assignee, workspace in self.sources:
+                if len(self.sources) == 1:
+                    path = cache_path
+                else:
+                    root, extension = os.path.splitext(cache_path)
+                    path = f'{root}-{workspace}-{assignee}{extension}'
+
+                self.caches[(assignee, workspace)] = TaskCache(path)
 
-        self.assignee_gid = assignee_gid
-        self.workspace_gid = workspace_gid
+        self.duration_field = duration_field
+        self.known_subtasks = {}  # Task GID to the subtasks fetched from Asana since tasks were last gotten, for set_tasks
+        self.scheduler = request_scheduler.get_scheduler('asana', is_retryable, retry_after)
+        self.default_minutes = default_minutes
 
+        # Only ask for the fields Rhythm reads, to keep responses small
         self.task_fields = [
             'this.name',
             'this.due_on',
             'this.memberships.project.name',
             'this.memberships.section.name',
-            'this.completed'
+            'this.completed',
+            'this.modified_at',
+            'this.tags.name'
         ]
         self.subtask_fields = [
             'this.name',
-            'this.due_on',
-            'this.completed'
+            'this.completed',
+            'this.tags.name'
         ]
 
-    def get_tasks(self, day: str) -> list:
-        """Get tasks and subtasks for Rhythm.
+        if count_subtasks:
+            self.task_fields.append('this.num_subtasks')
+
+        if duration_field is not None:
+            self.task_fields += ['this.custom_fields.name', 'this.custom_fields.number_value']
+            self.subtask_fields += ['this.custom_fields.name', 'this.custom_fields.number_value']
+
+    @property
+    def client(self):
+        """The Asana client, which is only created the first time it is used."""
+        with self.__client_lock:
+            if self.__client is None:
+                import asana
+
+                self.__client = asana.Client.access_token(self.access_token)
+                self.__client.headers = {'asana-enable': 'new_user_task_lists'}  # Supress warning
+
+        return self.__client
+
+    def get_tasks(self, day: str, use_cache: bool = True) -> list:
+        """Get tasks and subtasks for Rhythm from every assignee and workspace concurrently.
+
+        Tasks assigned to several of the people or found in several workspaces are only included once.
         
         Parameters:
             day (str): string representation of a day (ex: Monday).
+            use_cache (bool): if False, all tasks are fetched from Asana even if there is a cache.
         
         Returns:
-            rhythm_tasks (list): a list of dictionaries. Each dictionary is a task, with the keys title, notes, and due.
+            rhythm_tasks (list): a list of dictionaries. Each dictionary is a task, with the keys title, notes, due, and minutes.
         """
         target_date = Calendar.day_to_date(day)
 
-        tasks = self.client.tasks.get_tasks({
-            'assignee': self.assignee_gid,
-            'workspace': self.workspace_gid,
-            'completed_since': target_date.strftime('%Y-%m-%d'),
-            'opt_fields': self.task_fields
-        }, opt_pretty=True)
+        # Only subtasks fetched for this reset are trusted when completing tasks, since cached ones may be out of date
+        self.known_subtasks = {}
+
+        with ThreadPoolExecutor(max_workers=len(self.sources)) as executor:
+            source_tasks = list(executor.map(lambda source: self.__get_source_tasks(source, target_date, use_cache), self.sources))
 
+        # Each list is sorted by due date, so they can be merged without sorting them again
         rhythm_tasks = []
+        seen_gids = set()
 
-        for task in tasks:
-            if task['due_on'] is None or task['completed']:
-                continue
+        for rhythm_task in heapq.merge(*source_tasks, key=lambda x: x['due']):
+            gid = rhythm_task['notes'].split('\n')[1]
+
+            if gid not in seen_gids:
+                seen_gids.add(gid)
+                rhythm_tasks.append(rhythm_task)
+
+        return rhythm_tasks
+
+    def __get_source_tasks(self, source: tuple, target_date, use_cache: bool) -> list:
+        """Get tasks and subtasks for Rhythm from one assignee in one workspace.
 
+        Parameters:
+            source (tuple): the assignee GID and workspace GID.
+            target_date (date): the date being reset.
+            use_cache (bool): if False, all tasks are fetched from Asana even if there is a cache.
+
+        Returns:
+            rhythm_tasks (list): a list of Rhythm tasks, sorted by due date.
+        """
+        assignee_gid, workspace_gid = source
+
+        if source in self.caches and use_cache:
+            tasks, subtask_lists = self.__sync_cache(source)
+        else:
+            tasks = self.__list(self.client.tasks.get_tasks, {
+                'assignee': assignee_gid,
+                'workspace': workspace_gid,
+                'completed_since': target_date.strftime('%Y-%m-%d'),
+                'opt_fields': self.task_fields
+            }, operation='get_tasks')
+
+            tasks = [task for task in tasks if task['due_on'] is not None and not task['completed']]
+            subtask_lists = self.__get_subtask_lists(tasks)
+
+        rhythm_tasks = []
+
+        for task, subtasks in zip(tasks, subtask_lists):
             gid = task['gid']
             task_name = task['name']
 
@@ -67,9 +195,6 @@ class RhythmAsana:
             project_name = memberships[0]['project']['name'] if len(memberships) != 0 else 'Other'
             due_date = datetime.strptime(task['due_on'], '%Y-%m-%d')
 
-            subtasks = self.client.tasks.get_subtasks_for_task(gid, {
-                'opt_fields': self.subtask_fields
-            })
             subtasks = [s for s in subtasks if not s['completed']]
 
             if len(subtasks) == 0:
@@ -79,7 +204,8 @@ class RhythmAsana:
                 rhythm_task = {
                     'title': task_name,
                     'notes': f'{section_name} | {project_name}\n{gid}',
-                    'due': due
+                    'due': due,
+                    'minutes': self.estimate_minutes(task)
                 }
 
                 rhythm_tasks.append(rhythm_task)
@@ -104,7 +230,8 @@ class RhythmAsana:
                 rhythm_task = {
                     'title': f'{subtask_name} | {task_name}',
                     'notes': f'{section_name} | {project_name}\n{subtask_gid} {gid}',
-                    'due': due
+                    'due': due,
+                    'minutes': self.estimate_minutes(subtask)
                 }
 
                 rhythm_tasks.append(rhythm_task)
@@ -112,40 +239,245 @@ class RhythmAsana:
         rhythm_tasks.sort(key=lambda x: x['due'])
         return rhythm_tasks
 
-    def set_tasks(self, gids: list) -> None:
-        """Set tasks and subtasks as complete.
-        
+    def estimate_minutes(self, task: dict) -> int:
+        """Estimate how long a task takes from its duration custom field or a duration tag (ex: 30m or 2h).
+
+        Parameters:
+            task (dict): an Asana task or subtask.
+
+        Returns:
+            minutes (int): the estimated minutes, or the default if the task has no estimate of at least a minute.
+        """
+
+        # Estimates under a minute are skipped, since packing needs every task to take some time
+        if self.duration_field is not None:
+            for field in task.get('custom_fields', []):
+                if field['name'] == self.duration_field and field.get('number_value') is not None and int(field['number_value']) > 0:
+                    return int(field['number_value'])
+
+        for tag in task.get('tags', []):
+            match = DURATION_TAG.match(tag['name'].strip().lower())
+
+            if match is not None:
+                amount = float(match.group(1))
+                minutes = int(amount * 60) if match.group(2) in ('h', 'hr') else int(amount)
+
+                if minutes > 0:
+                    return minutes
+
+        return self.default_minutes
+
+    def __sync_cache(self, source: tuple) -> tuple[list, list]:
+        """Bring the cache of an assignee and workspace up to date, only fetching tasks modified since the last sync.
+
+        Parameters:
+            source (tuple): the assignee GID and workspace GID.
+
+        Returns:
+            tasks (list): a list of incomplete Asana tasks with due dates.
+            subtask_lists (list): a list of subtasks for each task, in the same order as the tasks.
+        """
+
+        assignee_gid, workspace_gid = source
+        cache = self.caches[source]
+
+        # Take the time before fetching so changes made during the fetch are picked up next time
+        now = datetime.now(timezone.utc)
+        last_sync = cache.get_meta('last_sync')
+        last_full_sync = cache.get_meta('last_full_sync')
+
+        if last_full_sync is None or now - datetime.fromisoformat(last_full_sync) > timedelta(hours=FULL_SYNC_HOURS):
+            tasks = self.__list(self.client.tasks.get_tasks, {
+                'assignee': assignee_gid,
+                'workspace': workspace_gid,
+                'completed_since': 'now',
+                'opt_fields': self.task_fields
+            }, operation='get_tasks')
+
+            cache.replace_tasks([task for task in tasks if task['due_on'] is not None])
+            cache.set_meta('last_full_sync', now.isoformat())
+        else:
+            # Completed tasks and tasks without due dates are evicted
+            tasks = self.__list(self.client.tasks.get_tasks, {
+                'assignee': assignee_gid,
+                'workspace': workspace_gid,
+                'modified_since': datetime.fromisoformat(last_sync).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'opt_fields': self.task_fields
+            }, operation='get_tasks')
+
+            keep = [task for task in tasks if task['due_on'] is not None and not task['completed']]
+            removed = [task['gid'] for task in tasks if task['due_on'] is None or task['completed']]
+            cache.update_tasks(keep, removed)
+
+        cache.set_meta('last_sync', now.isoformat())
+
+        # Use cached subtasks for tasks that have not been modified since they were cached
+        tasks = cache.get_tasks()
+        subtask_lists = [cache.get_subtasks(task['gid'], task['modified_at']) for task in tasks]
+
+        stale_indices = [i for i, subtasks in enumerate(subtask_lists) if subtasks is None]
+        stale_subtask_lists = self.__get_subtask_lists([tasks[i] for i in stale_indices])
+
+        for i, subtasks in zip(stale_indices, stale_subtask_lists):
+            cache.set_subtasks(tasks[i]['gid'], tasks[i]['modified_at'], subtasks)
+            subtask_lists[i] = subtasks
+
+        return tasks, subtask_lists
+
+    def __get_subtask_lists(self, tasks: list) -> list:
+        """Get the subtasks of each task concurrently.
+
+        Parameters:
+            tasks (list): a list of Asana tasks.
+
+        Returns:
+            subtask_lists (list): a list of subtasks for each task, in the same order as the tasks.
+        """
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = []
+
+            for task in tasks:
+                if self.count_subtasks and task.get('num_subtasks') == 0:
+                    # Skip the request if Asana says there are no subtasks
+                    futures.append(None)
+                else:
+                    futures.append(executor.submit(self.__get_subtasks, task['gid']))
+
+            subtask_lists = [future.result() if future is not None else [] for future in futures]
+
+        return subtask_lists
+
+    def __get_subtasks(self, gid: str) -> list:
+        """Get all subtasks of a task.
+
+        Parameters:
+            gid (str): the GID of the task.
+
+        Returns:
+            subtasks (list): a list of the task's subtasks.
+        """
+
+        subtasks = self.__list(self.client.tasks.get_subtasks_for_task, gid, {'opt_fields': self.subtask_fields}, operation='get_subtasks')
+        self.known_subtasks[gid] = subtasks
+        return subtasks
+
+    def set_tasks(self, gids: list, known_subtasks: dict = None) -> list:
+        """Set tasks and subtasks as complete, sending the updates concurrently.
+
+        A task whose subtasks are all complete is completed as well. Its subtasks are only fetched to check this if the
+        known subtasks do not show one that is still incomplete.
+
         Parameters:
             gids (list): a list of task and subtask GIDs. A subtask GID has the task GID and subtask GID separated by a space.
+            known_subtasks (dict): task GID to the subtasks fetched for the same reset, from known_subtasks right after
+                get_tasks. If not given, the subtasks of every task are fetched to check it.
+
+        Returns:
+            failures (list): a list of (GID, exception) tuples for each task that could not be completed.
         """
-        
+
+        complete_gids = []
         subtask_checks = []
 
-        for gid in gids:
+        for gid in dict.fromkeys(gids):
             split_gid = gid.split(' ')
-            complete_gid = split_gid[0]  # Will be task gid for full tasks and subtask gid for subtasks
-
-            # Complete task and check if subtask
-            self.client.tasks.update_task(complete_gid, {'completed': True})
+            complete_gids.append(split_gid[0])  # Will be task gid for full tasks and subtask gid for subtasks
 
             # Subtasks will have its gid and the task gid, making its split length 2
             if len(split_gid) > 1:
                 subtask_checks.append(split_gid[1])
 
-        subtask_checks = list(set(subtask_checks))
+        complete_gids = list(dict.fromkeys(complete_gids))
+        failures = self.__complete(complete_gids)
+        completed = set(complete_gids) - set(gid for gid, _ in failures)
+
+        # Skip tasks that were completed directly or have a known subtask that is still incomplete
+        subtask_checks = [gid for gid in dict.fromkeys(subtask_checks) if gid not in completed]
+        parent_checks = []
+
+        known_subtasks = known_subtasks if known_subtasks is not None else {}
 
         for gid in subtask_checks:
-            # Check if all subtasks of task are complete
-            subtasks = self.client.tasks.get_subtasks_for_task(gid, {
-                'opt_fields': self.subtask_fields
-            })
-            all_complete = True
-
-            for subtask in subtasks:
-                if not subtask['completed']:
-                    all_complete = False
-                    break
-            
-            if all_complete:
-                # Complete full task
-                self.client.tasks.update_task(gid, {'completed': True})
+            subtasks = known_subtasks.get(gid)
+
+            if subtasks is None or all(s['completed'] or s['gid'] in completed for s in subtasks):
+                parent_checks.append(gid)
+
+        # Check if all subtasks of each task are complete, then complete the full tasks
+        subtask_lists = self.__get_subtask_lists([{'gid': gid} for gid in parent_checks])
+        complete_parents = [gid for gid, subtasks in zip(parent_checks, subtask_lists) if all(s['completed'] for s in subtasks)]
+
+        parent_failures = self.__complete(complete_parents)
+        completed |= set(complete_parents) - set(gid for gid, _ in parent_failures)
+
+        for cache in self.caches.values():
+            # Evict completed tasks and refetch subtasks of the rest, since completing subtasks does not modify the task
+            cache.update_tasks([], list(completed))
+            cache.invalidate_subtasks(subtask_checks)
+
+        return failures + parent_failures
+
+    def __complete(self, gids: list) -> list:
+        """Complete tasks concurrently through the request scheduler.
+
+        Parameters:
+            gids (list): the GIDs of the tasks to complete.
+
+        Returns:
+            failures (list): a list of (GID, exception) tuples for each task that could not be completed.
+        """
+
+        def complete(gid):
+            try:
+                self.__request(self.client.tasks.update_task, gid, {'completed': True})
+            except Exception as e:
+                return gid, e
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = list(executor.map(complete, gids))
+
+        return [result for result in results if result is not None]
+
+    def __list(self, function, *args, operation: str = None) -> list:
+        """Get every item of an Asana collection, sending each page as its own request through the request scheduler
+        so the rate limit and retries apply to each page instead of the whole collection.
+
+        Parameters:
+            function: the client function that gets the collection.
+            args: the arguments to call it with.
+            operation (str): the name to record the metrics of each page under.
+
+        Returns:
+            items (list): the items of every page.
+        """
+
+        items = []
+        offset = None
+
+        while True:
+            # Without an iterator, the client returns one page with the offset of the next
+            page = self.__request(function, *args, operation=operation, iterator_type=None, full_payload=True, limit=PAGE_SIZE, offset=offset)
+            items += page['data']
+
+            if page.get('next_page') is None:
+                return items
+
+            offset = page['next_page']['offset']
+
+    def __request(self, function, *args, operation: str = None, **options):
+        """Call an Asana client function through the request scheduler, which limits the request rate and retries
+        requests that hit the rate limit or fail on the server.
+
+        Parameters:
+            function: the client function to call.
+            args: the arguments to call it with.
+            operation (str): the name to record the request's metrics under. If not given, the function's name is used.
+            options: client options to call it with.
+
+        Returns:
+            result: the result of the function.
+        """
+
+        # Retries are handled by the scheduler, so the client should not retry on its own
+        return self.scheduler.execute(function, *args, operation=operation, max_retries=0, **options)
@@ -0,0 +1,528 @@
+"""Handles reading and checking rulesets, parsing each file only once until it changes."""
+
+import heapq
+import json
+import os
+import threading
+from typing import NamedTuple
+
+
+class Rule(NamedTuple):
+    """An event from a ruleset, with times in seconds since midnight."""
+
+    name: str
+    start: int
+    end: int
+    line: int  # Index of the line in the ruleset the rule came from
+
+
+class Issue(NamedTuple):
+    """A mistake or possible mistake found in a ruleset."""
+
+    line: int  # Index of the line in the ruleset the issue is on
+    message: str
+    error: bool  # Errors are lines that are ignored, while the rest are warnings about rules that are used
+    path: str = None  # Path of the ruleset the issue is in, which is set in resolved rulesets
+
+
+class Include(NamedTuple):
+    """A directive that puts the rules of another ruleset into a ruleset."""
+
+    line: int  # Index of the line in the ruleset the directive is on
+    kind: str  # extends to put the rules before every rule of the ruleset, or include to put them where the line is
+    name: str  # File name of the ruleset in the rulesets folder, without .txt
+
+
+class Ruleset(NamedTuple):
+    """A parsed ruleset file."""
+
+    name: str
+    rules: list  # Rules in the order they appear
+    comments: list  # (line index, comment text) tuples
+    issues: list = []  # Issues in the order of their lines
+    includes: list = []  # Includes in the order of their lines
+
+
+def time_to_seconds(time: str) -> int:
+    """Convert time into the second it corresponds with.
+
+    Parameters:
+        time (str): string representation of a time in the format HH:MM or HH:MM:SS.
+
+    Returns:
+        seconds (int): the amount of seconds since midnight. Will return -1 if the time is not valid.
+    """
+
+    time_split = time.split(':')
+
+    if len(time_split) not in (2, 3):
+        return -1
+
+    try:
+        parts = [int(part) for part in time_split] + [0]
+    except ValueError:
+        return -1
+
+    seconds = (parts[0] * 3600) + (parts[1] * 60) + parts[2]
+    return seconds
+
+
+def parse_rules(ruleset: list, issues: list = None) -> list[Rule]:
+    """Parse the rules out of the lines of a ruleset. Lines that are not valid rules are skipped.
+
+    Parameters:
+        ruleset (list): each line of the ruleset.
+        issues (list): if given, an error is added to it for each line after the name that is skipped but not blank.
+
+    Returns:
+        rules (list): the rules in the order they appear in the ruleset.
+    """
+
+    rules = []
+
+    for i, rule in enumerate(ruleset):
+        # Remove comments
+        comment_index = rule.find('#')
+
+        if comment_index != -1:
+            rule = rule[:comment_index].strip()
+
+        # Directives are read by parse_ruleset
+        if i != 0 and rule.strip().startswith('@'):
+            continue
+
+        # Skip line if there are not 3 arguments (name, start time, end time)
+        rule_args = rule.split(', ')
+
+        if len(rule_args) != 3:
+            if issues is not None and i != 0 and rule.strip() != '':
+                issues.append(Issue(i, 'expected name, start time (HH:MM), end time (HH:MM)', True))
+
+            continue
+
+        # Parse times and continue if parsing fails
+        start_time = time_to_seconds(rule_args[1].strip())
+        end_time = time_to_seconds(rule_args[2].strip())
+
+        if start_time == -1 or end_time == -1:
+            if issues is not None:
+                bad_time = rule_args[1] if start_time == -1 else rule_args[2]
+                issues.append(Issue(i, f'invalid time "{bad_time.strip()}"', True))
+
+            continue
+
+        if issues is not None and end_time <= start_time:
+            issues.append(Issue(i, f'{rule_args[0]} ends before it starts, so it is ignored', True))
+
+        rules.append(Rule(rule_args[0], start_time, end_time, i))
+
+    return rules
+
+
+def find_overlaps(rules: list[Rule]) -> list[Issue]:
+    """Find rules that overlap earlier rules, whose time they take over.
+
+    Parameters:
+        rules (list): the rules in the order they appear in the ruleset.
+
+    Returns:
+        issues (list): a warning on the later rule of each pair of overlapping rules.
+    """
+
+    issues = []
+    active = []  # (end, rule) of rules that started before the current rule, with the first to end on top
+
+    for rule in sorted((rule for rule in rules if rule.start < rule.end), key=lambda x: (x.start, x.line)):
+        while len(active) != 0 and active[0][0] <= rule.start:
+            heapq.heappop(active)
+
+        for _, other in active:
+            earlier, later = (other, rule) if other.line < rule.line else (rule, other)
+            issues.append(Issue(later.line, f'{later.name} overlaps {earlier.name} on line {earlier.line + 1} and takes over its time', False))
+
+        heapq.heappush(active, (rule.end, rule))
+
+    return issues
+
+
+def parse_ruleset(text: str) -> Ruleset:
+    """Parse the text of a ruleset file.
+
+    Parameters:
+        text (str): the text of the file.
+
+    Returns:
+        ruleset (Ruleset): the name, rules, comments, issues, and includes of the ruleset.
+    """
+
+    lines = text.split('\n')
+    comments = [(i, line[line.find('#') + 1:].strip()) for i, line in enumerate(lines) if '#' in line]
+
+    issues = []
+    rules = parse_rules(lines, issues)
+    issues += find_overlaps(rules)
+    includes = []
+
+    for i, line in enumerate(lines[1:], 1):
+        directive = line.split('#')[0].split()
+
+        if len(directive) == 0 or not directive[0].startswith('@'):
+            continue
+
+        if directive[0] not in ('@extends', '@include') or len(directive) != 2:
+            issues.append(Issue(i, 'expected @extends name or @include name', True))
+            continue
+
+        includes.append(Include(i, directive[0][1:], directive[1]))
+
+    issues.sort(key=lambda x: x.line)
+
+    return Ruleset(lines[0], rules, comments, issues, includes)
+
+
+class RulesetRepository:
+    """Reads rulesets, caching them by path until the file's modification time or size changes."""
+
+    def __init__(self, cache_path: str = None, include_directory: str = 'rulesets') -> None:
+        """Creates a repository.
+
+        Parameters:
+            cache_path (str): the path to a JSON file to keep parsed rulesets in between runs. If not given, rulesets are only cached in memory.
+            include_directory (str): the folder that the rulesets named by @extends and @include are in.
+        """
+
+        self.cache_path = cache_path
+        self.include_directory = include_directory
+        self.rulesets = {}  # Path to (file key, Ruleset)
+        self.resolved = {}  # Path to ({path of it and each ruleset it depends on: file key}, Ruleset with includes put in)
+        self.compiled = {}  # Path to ({path of it and each ruleset it depends on: file key}, {name: what was compiled from the ruleset})
+        self.names = {}  # Path to (file key, name)
+        self.changed = False
+        self.lock = threading.Lock()  # Rulesets can be loaded by background jobs while the prompt reads names
+
+        if cache_path is not None and os.path.exists(cache_path):
+            # A cache that cannot be read is treated as empty, since every ruleset can be parsed again
+            try:
+                with open(cache_path) as file:
+                    cached = json.load(file)
+            except (OSError, ValueError):
+                cached = {}
+
+            for path, entry in cached.items():
+                # Rulesets cached before includes were read are parsed again
+                if 'includes' not in entry:
+                    continue
+
+                rules = [Rule(*rule) for rule in entry['rules']]
+                comments = [tuple(comment) for comment in entry['comments']]
+                issues = [Issue(*issue) for issue in entry['issues']]
+                includes = [Include(*include) for include in entry['includes']]
+                self.rulesets[path] = (tuple(entry['key']), Ruleset(entry['name'], rules, comments, issues, includes))
+
+                if 'dependencies' in entry:
+                    dependencies = {dependency: tuple(key) if key is not None else None for dependency, key in entry['dependencies'].items()}
+                    self.compiled[path] = (dependencies, entry['compiled'])
+
+    @staticmethod
+    def file_key(path: str) -> tuple:
+        """Get the values that change when a file is modified.
+
+        Parameters:
+            path (str): the path to the file.
+
+        Returns:
+            key (tuple): the modification time in nanoseconds and size of the file.
+        """
+
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    @classmethod
+    def current(cls, dependencies: dict) -> bool:
+        """Check whether none of the files a ruleset depends on changed.
+
+        Parameters:
+            dependencies (dict): the file key of each path, or None for files that did not exist.
+
+        Returns:
+            current (bool): whether every file still has the same key.
+        """
+
+        return all((cls.file_key(path) if os.path.exists(path) else None) == key for path, key in dependencies.items())
+
+    def include_path(self, name: str) -> str:
+        """Get the path of a ruleset named by @extends or @include.
+
+        Parameters:
+            name (str): the name in the directive.
+
+        Returns:
+            path (str): the path to the ruleset.
+        """
+
+        return f'{self.include_directory}/{name}.txt'
+
+    def load(self, path: str) -> Ruleset:
+        """Get a parsed ruleset, only reading the file if it changed since it was last parsed.
+
+        Parameters:
+            path (str): the path to the ruleset.
+
+        Returns:
+            ruleset (Ruleset): the parsed ruleset.
+        """
+
+        key = self.file_key(path)
+        cached = self.rulesets.get(path)
+
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        with open(path) as file:
+            ruleset = parse_ruleset(file.read())
+
+        with self.lock:
+            self.rulesets[path] = (key, ruleset)
+            self.changed = True
+
+        return ruleset
+
+    def resolve(self, path: str) -> Ruleset:
+        """Get a ruleset with the rules of the rulesets it extends and includes put in, only resolving it again if it or
+        one of the rulesets it depends on changed.
+
+        Extended rules come before every rule of the ruleset and included rules are put where the directive is, so the
+        rules of the ruleset take priority over the ones it extends. Each ruleset is only parsed once however many
+        rulesets depend on it. Issues are kept with the path of the ruleset they are in, and directives that name a
+        missing ruleset or would include a ruleset in itself are errors.
+
+        Parameters:
+            path (str): the path to the ruleset.
+
+        Returns:
+            ruleset (Ruleset): the ruleset with its includes put in.
+        """
+
+        return self.__resolve(path, ())[0]
+
+    def load_compiled(self, path: str, name: str, compile_function):
+        """Get something compiled from a resolved ruleset, like its blocks, only compiling it again if the file or one of
+        the rulesets it depends on changed.
+
+        Parameters:
+            path (str): the path to the ruleset.
+            name (str): the name of what is compiled, so several things can be compiled from one ruleset.
+            compile_function: a function that takes the resolved Ruleset and returns what is compiled from it. The result
+                is kept in the cache file, so it should be made of lists, strings, and numbers.
+
+        Returns:
+            compiled: the result of compile_function, which may be read back from the cache file.
+        """
+
+        cached = self.compiled.get(path)
+
+        if cached is not None and name in cached[1] and self.current(cached[0]):
+            return cached[1][name]
+
+        ruleset, dependencies, _ = self.__resolve(path, ())
+        compiled = compile_function(ruleset)
+
+        with self.lock:
+            if cached is None or cached[0] != dependencies:
+                self.compiled[path] = (dependencies, {})
+
+            self.compiled[path][1][name] = compiled
+            self.changed = True
+
+        return compiled
+
+    def __resolve(self, path: str, stack: tuple) -> tuple:
+        cached = self.resolved.get(path)
+
+        if cached is not None and self.current(cached[0]):
+            return cached[1], cached[0], True
+
+        ruleset = self.load(path)
+        dependencies = {path: self.file_key(path)}
+
+        # Extended rulesets go first, then included rulesets go between the rules around them
+        items = [(-1, include) for include in ruleset.includes if include.kind == 'extends']
+        items += [(rule.line, rule) for rule in ruleset.rules]
+        items += [(include.line, include) for include in ruleset.includes if include.kind == 'include']
+        items.sort(key=lambda x: x[0])
+
+        rules = []
+        issues = [issue._replace(path=path) for issue in ruleset.issues]
+        complete = True  # Rulesets resolved while cutting a cycle depend on where the cycle started, so are not kept
+        stack += (path,)
+
+        for _, item in items:
+            if isinstance(item, Rule):
+                rules.append(item)
+                continue
+
+            include_path = self.include_path(item.name)
+
+            if include_path in stack:
+                cycle = ' -> '.join(stack[stack.index(include_path):] + (include_path,))
+                issues.append(Issue(item.line, f'@{item.kind} {item.name} includes the ruleset in itself ({cycle}), so it is ignored', True, path))
+                complete = False
+                continue
+
+            if not os.path.exists(include_path):
+                issues.append(Issue(item.line, f'no ruleset named {item.name} in {self.include_directory}', True, path))
+                dependencies[include_path] = None
+                continue
+
+            base, base_dependencies, base_complete = self.__resolve(include_path, stack)
+            rules += base.rules
+            issues += base.issues
+            dependencies.update(base_dependencies)
+            complete = complete and base_complete
+
+        issues.sort(key=lambda x: (x.path != path, x.line))
+        resolved = Ruleset(ruleset.name, rules, ruleset.comments, issues, ruleset.includes)
+
+        if complete:
+            with self.lock:
+                self.resolved[path] = (dependencies, resolved)
+
+        return resolved, dependencies, complete
+
+    def read_name(self, path: str) -> str:
+        """Get the name of a ruleset, only reading its first line.
+
+        Parameters:
+            path (str): the path to the ruleset.
+
+        Returns:
+            name (str): the first line of the ruleset.
+        """
+
+        key = self.file_key(path)
+        cached = self.rulesets.get(path)
+
+        if cached is not None and cached[0] == key:
+            return cached[1].name
+
+        cached = self.names.get(path)
+
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        with open(path) as file:
+            name = file.readline().rstrip('\n')
+
+        self.names[path] = (key, name)
+        return name
+
+    def save(self) -> None:
+        """Write the parsed rulesets to the cache file if any were parsed since it was last written."""
+
+        if self.cache_path is None or not self.changed:
+            return
+
+        directory = os.path.dirname(self.cache_path)
+
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        cached = {}
+
+        # Saves from a background job and the prompt are written one at a time
+        with self.lock:
+            rulesets = list(self.rulesets.items())
+            compiled = dict(self.compiled)
+            self.changed = False
+
+            for path, (key, ruleset) in rulesets:
+                cached[path] = {
+                    'key': list(key),
+                    'name': ruleset.name,
+                    'rules': [list(rule) for rule in ruleset.rules],
+                    'comments': [list(comment) for comment in ruleset.comments],
+                    'issues': [list(issue) for issue in ruleset.issues],
+                    'includes': [list(include) for include in ruleset.includes]
+                }
+
+                if path in compiled:
+                    dependencies, values = compiled[path]
+                    cached[path]['dependencies'] = {dependency: list(key) if key is not None else None for dependency, key in dependencies.items()}
+                    cached[path]['compiled'] = values
+
+            # Write to another file first so a crash while writing cannot leave a broken cache
+            with open(f'{self.cache_path}.tmp', 'w') as file:
+                json.dump(cached, file)
+
+            os.replace(f'{self.cache_path}.tmp', self.cache_path)
+
+
+repository = RulesetRepository()
+
+
+def load_ruleset(path: str) -> Ruleset:
+    """Get a parsed ruleset from the shared repository.
+
+    Parameters:
+        path (str): the path to the ruleset.
+
+    Returns:
+        ruleset (Ruleset): the parsed ruleset.
+    """
+
+    return repository.load(path)
+
+
+def resolve_ruleset(path: str) -> Ruleset:
+    """Get a ruleset with the rulesets it extends and includes put in from the shared repository.
+
+    Parameters:
+        path (str): the path to the ruleset.
+
+    Returns:
+        ruleset (Ruleset): the ruleset with its includes put in.
+    """
+
+    return repository.resolve(path)
+
+
+def read_name(path: str) -> str:
+    """Get the name of a ruleset from the shared repository.
+
+    Parameters:
+        path (str): the path to the ruleset.
+
+    Returns:
+        name (str): the first line of the ruleset.
+    """
+
+    return repository.read_name(path)
+
+
+def load_compiled(path: str, name: str, compile_function):
+    """Get something compiled from a ruleset from the shared repository.
+
+    Parameters:
+        path (str): the path to the ruleset.
+        name (str): the name of what is compiled.
+        compile_function: a function that takes the resolved Ruleset and returns what is compiled from it.
+
+    Returns:
+        compiled: the result of compile_function.
+    """
+
+    return repository.load_compiled(path, name, compile_function)
+
+
+def format_issues(path: str, ruleset: Ruleset) -> list:
+    """Format the issues of a ruleset with the path and line number of each.
+
+    Parameters:
+        path (str): the path to the ruleset.
+        ruleset (Ruleset): the parsed or resolved ruleset. Issues in rulesets it depends on are shown with their own path.
+
+    Returns:
+        lines (list): a line for each issue (ex: rulesets/day.txt:3: error: invalid time "7:xx").
+    """
+
+    return [f'{issue.path or path}:{issue.line + 1}: {"error" if issue.error else "warning"}: {issue.message}' for issue in ruleset.issues]
@@ -1,11 +1,29 @@
 """Handles creating schedules."""
 
+import heapq
+from typing import NamedTuple
+
+import metrics
+from ruleset_repository import Rule, load_compiled
+
+TODO_LIST = 'Todo List'
+DAY_SECONDS = 24 * 60 * 60
+
+
+class Block(NamedTuple):
+	"""A continuous block of time in a schedule, with times in seconds since midnight."""
+
+	name: str
+	start: int
+	end: int
+
+
 def time_to_minutes(time: str) -> int:
 	"""Convert time into the minute it corresponds with.
-	
+
 	Parameters:
 		time (str): string representation of a time in the format HH:MM.
-	
+
 	Returns:
 		minutes (int): the amount of minutes since midnight. Will return -1 if the time is not valid.
 	"""
@@ -19,83 +37,130 @@ def time_to_minutes(time: str) -> int:
 	return minutes
 
 
-def generate_schedule(path: str) -> tuple[str, list]:
-	"""Create a new schedule from the ruleset of the path given.
-	
+def seconds_to_time(seconds: int) -> str:
+	"""Convert seconds since midnight into a time.
+
 	Parameters:
-		path (str): the path to the schedule.
-	
+		seconds (int): the amount of seconds since midnight.
+
 	Returns:
-		schedule (str): the schedule of the day, with each line corresponding to the minute of the day.
-		minute_count (int): the count of minutes in the schedule that are marked as todo list.
+		time (str): string representation of the time in the format H:MM, or H:MM:SS if it is not on a minute.
+	"""
+
+	time = f'{seconds // 3600}:{str(seconds // 60 % 60).zfill(2)}'
+
+	if seconds % 60 != 0:
+		time += f':{str(seconds % 60).zfill(2)}'
+
+	return time
+
+
+def build_blocks(rules: list[Rule], resolution: int = 60) -> list[Block]:
+	"""Create the blocks of a schedule from rules. Later rules take priority over earlier rules where they overlap,
+	and any time not covered by a rule is Todo List time.
+
+	Parameters:
+		rules (list): the rules of the schedule.
+		resolution (int): the amount of seconds that start and end times are rounded down to.
+
+	Returns:
+		blocks (list): the blocks of the day in order, without gaps except for rules with empty names.
+	"""
+
+	# Round times to the resolution and keep them inside the day
+	intervals = []
+
+	for priority, rule in enumerate(rules):
+		start = min(max(rule.start - (rule.start % resolution), 0), DAY_SECONDS)
+		end = min(max(rule.end - (rule.end % resolution), 0), DAY_SECONDS)
+
+		if start < end:
+			intervals.append((start, end, priority))
+
+	intervals.sort()
+	points = sorted({0, DAY_SECONDS} | {i[0] for i in intervals} | {i[1] for i in intervals})
+
+	# Sweep through each point, keeping a heap of the rules covering it with the highest priority on top
+	active = []
+	blocks = []
+	next_interval = 0
+
+	for start, end in zip(points, points[1:]):
+		while next_interval < len(intervals) and intervals[next_interval][0] <= start:
+			interval_end, priority = intervals[next_interval][1:]
+			heapq.heappush(active, (-priority, interval_end))
+			next_interval += 1
+
+		# Rules that ended are only removed once they reach the top, since only the top is used
+		while len(active) != 0 and active[0][1] <= start:
+			heapq.heappop(active)
+
+		name = rules[-active[0][0]].name if len(active) != 0 else TODO_LIST
+
+		if len(blocks) != 0 and blocks[-1].name == name:
+			blocks[-1] = Block(name, blocks[-1].start, end)
+		else:
+			blocks.append(Block(name, start, end))
+
+	blocks = [block for block in blocks if block.name != '']
+	return blocks
+
+
+def todo_minutes(blocks: list[Block]) -> int:
+	"""Count the minutes of Todo List time in a schedule.
+
+	Parameters:
+		blocks (list): the blocks of the schedule.
+
+	Returns:
+		minutes (int): the amount of minutes in Todo List blocks.
 	"""
 
-	# Get the ruleset from the path
-	with open(path) as file:
-		ruleset = file.read().split('\n')
-	
-	minutes = ['Todo List'] * (24 * 60)
+	return sum(block.end - block.start for block in blocks if block.name == TODO_LIST) // 60
 
-	# Load definite rules
-	for rule in ruleset:
-		# Remove comments
-		comment_index = rule.find('#')
 
-		if comment_index != -1:
-			rule = rule[:comment_index].strip()
+def format_schedule(blocks: list[Block]) -> str:
+	"""Format the blocks of a schedule as text.
 
-		# Load rule arguments in
-		rule_args = rule.split(', ')
-		name = rule_args[0] + ''
+	Parameters:
+		blocks (list): the blocks of the schedule.
 
-		# Skip line if there are not 3 arguments (name, start time, end time)
-		if len(rule_args) != 3:
-			continue
+	Returns:
+		schedule (str): each block in the format name, H:MM (start), H:MM (end), separated by new lines.
+	"""
 
-		# Parse times and continue if parsing fails
-		start_time = time_to_minutes(rule_args[1])
-		end_time = time_to_minutes(rule_args[2])
+	lines = [f'{block.name}, {seconds_to_time(block.start)}, {seconds_to_time(block.end)}' for block in blocks]
+	return '\n'.join(lines).strip()
 
-		if start_time == -1 or end_time == -1:
-			continue
 
-		# Add task to minutes
-		for t in range(start_time, end_time):
-			minutes[t] = name + ''
+@metrics.timed('schedule.generate_blocks')
+def generate_blocks(path: str, resolution: int = 60) -> list[Block]:
+	"""Create the blocks of a new schedule from the ruleset of the path given.
 
-	# Convert minutes to schedule
-	schedule = ''
-	m = 0
+	The blocks are compiled once and kept with the parsed ruleset until it or a ruleset it extends or includes changes.
 
-	while True:
-		if m >= len(minutes):
-			break
+	Parameters:
+		path (str): the path to the schedule.
+		resolution (int): the amount of seconds that start and end times are rounded down to.
 
-		if minutes[m] == '':
-			m += 1
-			continue
+	Returns:
+		blocks (list): the blocks of the day in order.
+	"""
 
-		task = minutes[m] + ''
-		start_m = m + 0
-		filled = False
+	compiled = load_compiled(path, f'blocks-{resolution}', lambda ruleset: [list(block) for block in build_blocks(ruleset.rules, resolution)])
+	return [Block(*block) for block in compiled]
 
-		for t in range(m + 1, len(minutes)):
-			if minutes[t] != task:
-				# End of task
-				end_m = t + 0
-				filled = True
-				break
 
-		if not filled:
-			# If not filled, then hit end of day
-			end_m = len(minutes) + 0
+def generate_schedule(path: str) -> tuple[str, int]:
+	"""Create a new schedule from the ruleset of the path given.
 
-		start_hour = int(start_m / 60)
-		end_hour = int(end_m / 60)
-		start_minute = str(start_m % 60).zfill(2)
-		end_minute = str(end_m % 60).zfill(2)
+	Parameters:
+		path (str): the path to the schedule.
 
-		schedule += f'{task}, {start_hour}:{start_minute}, {end_hour}:{end_minute}\n'
-		m = end_m + 0
+	Returns:
+		schedule (str): the schedule of the day, with each line corresponding to a block of the day.
+		minute_count (int): the count of minutes in the schedule that are marked as todo list.
+	"""
 
-	return schedule.strip(), minutes.count('Todo List')
+	blocks = generate_blocks(path)
+	return format_schedule(blocks), todo_minutes(blocks)
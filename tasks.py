@@ -1,77 +1,183 @@
 """Handles reading and writing from Google Tasks."""
 
-import os
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
+import google_batch
+import google_services
+
+TASK_FIELDS = ['title', 'notes', 'due']  # Fields of a Rhythm task that are sent to Google Tasks
+LIST_PAGE_SIZE = 100  # Most tasks Google Tasks returns in one page
+LIST_FIELDS = 'id,title,notes,status'  # Fields of each listed task that Rhythm reads
 
 
 class Tasks:
     """A class that handles reading and writing from Google Tasks."""
 
-    def __init__(self, tasklist_id: str) -> None:
-        """Creates a Tasks instance and gets a Google Tasks service.
+    def __init__(self, tasklist_id: str, service=None) -> None:
+        """Creates a Tasks instance. The Google Tasks service is only created the first time it is used.
         
         Parameters:
             tasklist_id (str): the tasklist ID for Google Tasks.
+            service: an existing Google Tasks service to use instead of creating a new one.
         """
 
-        self.service = self.__get_service()
+        self.__service = service
         self.tasklist_id = tasklist_id
+        self.scheduler = google_services.get_scheduler('tasks')
+
+    @property
+    def service(self):
+        """The Google Tasks service, which is only created the first time it is used."""
+        if self.__service is None:
+            self.__service = google_services.get_service('tasks')
+
+        return self.__service
+
+    def add_task(self, task: dict) -> None:
+        """Adds task to list.
+        
+        Parameters:
+            task (dict): the task to add. It should have a title, notes, and due sections.
+        """
+
+        body = {key: task[key] for key in TASK_FIELDS if key in task}
+        self.scheduler.execute(self.service.tasks().insert(tasklist=self.tasklist_id, body=body, fields='id').execute)
 
-    def __get_service(self):
-        """Get a Google Tasks service. The tasklist ID used will be the class tasklist_id.
+    def add_tasks(self, tasks: list) -> list:
+        """Adds tasks to list using batch requests, keeping the order they are given in.
+
+        Each new task is put at the top of the list, so the tasks are inserted in reverse order. The server can run the
+        requests of a batch in any order, so the order is checked afterwards and fixed if needed.
+
+        Parameters:
+            tasks (list): the tasks to add, in the order they should appear from the top of the list. Each should have a title, notes, and due sections.
 
         Returns:
-            A Google Tasks service.
+            failures (list): a list of (task, exception) tuples for each task that could not be added.
         """
 
-        SCOPES = ['https://www.googleapis.com/auth/tasks']
-        creds = None
-        if os.path.exists('credentials/tasks_token.json'):
-            creds = Credentials.from_authorized_user_file('credentials/tasks_token.json', SCOPES)
+        tasks = list(reversed(tasks))
+        bodies = [{key: task[key] for key in TASK_FIELDS if key in task} for task in tasks]
+        requests = [self.service.tasks().insert(tasklist=self.tasklist_id, body=body, fields='id') for body in bodies]
+        responses, errors = google_batch.execute_batch(self.scheduler, self.service, requests)
 
-        # If there are no (valid) credentials available, let the user log in.
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials/tasks.json', SCOPES)
-                creds = flow.run_local_server(port=0)
-            
-            # Save the credentials for the next run
-            with open('credentials/tasks_token.json', 'w') as token:
-                token.write(creds.to_json())
+        # Top of the list is the last task inserted
+        task_ids = [response['id'] for response, error in zip(responses, errors) if error is None]
+        task_ids.reverse()
+        self.__fix_order(task_ids)
 
-        return build('tasks', 'v1', credentials=creds)
+        failures = [(task, error) for task, error in zip(tasks, errors) if error is not None]
+        failures.reverse()
+        return failures
+
+    def __fix_order(self, task_ids: list) -> None:
+        """Moves tasks so that they appear in the order given at the top of the list.
 
-    def add_task(self, task: dict) -> None:
-        """Adds task to list.
-        
         Parameters:
-            task (dict): the task to add. It should have a title, notes, and due sections.
+            task_ids (list): the IDs of the tasks in the order they should appear.
         """
 
-        self.service.tasks().insert(tasklist=self.tasklist_id, body=task).execute()
+        if len(task_ids) < 2:
+            return
+
+        positions = {item['id']: item['position'] for item in self.list_tasks(show_completed=False, fields='id,position')}
+
+        current_order = sorted([task_id for task_id in task_ids if task_id in positions], key=lambda x: positions[x])
+
+        if current_order == [task_id for task_id in task_ids if task_id in positions]:
+            return
+
+        # Move each task after the previous one, starting from the top
+        previous = None
+
+        for task_id in task_ids:
+            if previous is None:
+                self.scheduler.execute(self.service.tasks().move(tasklist=self.tasklist_id, task=task_id, fields='id').execute)
+            else:
+                self.scheduler.execute(self.service.tasks().move(tasklist=self.tasklist_id, task=task_id, previous=previous, fields='id').execute)
+
+            previous = task_id
     
-    def get_completed_tasks(self) -> list:
+    def list_tasks(self, show_completed: bool = True, completed_min: str = None, fields: str = LIST_FIELDS):
+        """Yield each task in the list, getting another page only once the tasks before it have been used.
+
+        Parameters:
+            show_completed (bool): whether to include completed tasks, including ones hidden by completing them in a Google app.
+            completed_min (str): if given, only tasks completed at or after this datetime string are included.
+            fields (str): the fields of each task to get, to keep responses small.
+
+        Yields:
+            task (dict): a Google Tasks task with only the fields asked for.
+        """
+
+        page_token = None
+
+        while True:
+            request = self.service.tasks().list(
+                tasklist=self.tasklist_id,
+                maxResults=LIST_PAGE_SIZE,
+                pageToken=page_token,
+                showCompleted=show_completed,
+                showHidden=show_completed,
+                completedMin=completed_min,
+                fields=f'nextPageToken,items({fields})'
+            )
+            response = self.scheduler.execute(request.execute)
+
+            yield from response.get('items', [])
+            page_token = response.get('nextPageToken')
+
+            if page_token is None:
+                return
+
+    def scan_tasks(self) -> tuple[list, list]:
+        """Lists the tasks once, finding both the Asana tasks that were completed and every task to delete.
+
+        Returns:
+            task_gids (list): the task and subtask GIDs of each completed task. Tasks without a GID line are skipped.
+            tasks (list): every task in the list.
+        """
+
+        task_gids = []
+        tasks = []
+
+        for task in self.list_tasks():
+            tasks.append(task)
+
+            # Google leaves out empty notes, so tasks added by hand may have none
+            lines = task.get('notes', '').split('\n')
+
+            if task['status'] == 'completed' and len(lines) > 1:
+                task_gids.append(lines[1])
+
+        return task_gids, tasks
+
+    def get_completed_tasks(self, completed_min: str = None) -> list:
         """Gets completed tasks from list.
-        
+
         Parameters:
+            completed_min (str): if given, only tasks completed at or after this datetime string are included.
+
+        Returns:
             task_gids (list): a list of task and subtask GIDs that have been completed.
         """
 
-        tasks = self.service.tasks().list(tasklist=self.tasklist_id, showHidden=True).execute()['items']
-        completed_tasks = [task for task in tasks if task['status'] == 'completed']
+        tasks = self.list_tasks(completed_min=completed_min, fields='notes,status')
+        return [task['notes'].split('\n')[1] for task in tasks if task['status'] == 'completed' and len(task.get('notes', '').split('\n')) > 1]
+
+    def clear_tasks(self, tasks: list = None) -> list:
+        """Deletes all tasks from list using batch requests.
+
+        Parameters:
+            tasks (list): the tasks in the list, from scan_tasks. If not given, the tasks are listed first.
+
+        Returns:
+            failures (list): a list of (task, exception) tuples for each task that could not be deleted.
+        """
 
-        task_gids = [task['notes'].split('\n')[1] for task in completed_tasks]
-        return task_gids
+        if tasks is None:
+            tasks = list(self.list_tasks())
 
-    def clear_tasks(self) -> None:
-        """Deletes all tasks from list."""
-        tasks = self.service.tasks().list(tasklist=self.tasklist_id, showHidden=True).execute()['items']
+        requests = [self.service.tasks().delete(tasklist=self.tasklist_id, task=task['id']) for task in tasks]
+        _, errors = google_batch.execute_batch(self.scheduler, self.service, requests)
 
-        for task in tasks:
-            self.service.tasks().delete(tasklist=self.tasklist_id, task=task['id']).execute()
+        failures = [(task, error) for task, error in zip(tasks, errors) if error is not None]
+        return failures